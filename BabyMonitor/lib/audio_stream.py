@@ -0,0 +1,126 @@
+import threading
+from collections import deque
+import numpy as np
+
+MU = 255.0
+
+
+def downsample(samples, factor=1):
+    """
+    Average every `factor` samples (box low-pass + decimation)
+
+    @param numpy-Array samples
+    @return numpy-Array
+    """
+    if factor <= 1:
+        return samples
+    count = len(samples) - len(samples) % factor
+    return samples[:count].reshape(-1, factor).mean(axis=1)
+
+
+def encode_int16(samples):
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+
+
+def encode_mulaw(samples):
+    """
+    mu-law companded 8 bit samples, 128 is silence
+
+    @param numpy-Array samples: float in [-1.0, 1.0]
+    @return bytes
+    """
+    samples = np.clip(samples, -1.0, 1.0)
+    companded = np.sign(samples) * np.log1p(MU * np.abs(samples)) / np.log1p(MU)
+    return np.round((companded + 1.0) * 127.5).astype(np.uint8).tobytes()
+
+
+def decode_mulaw(data):
+    companded = np.frombuffer(data, np.uint8).astype(np.float32) / 127.5 - 1.0
+    return np.sign(companded) * np.expm1(np.abs(companded) * np.log1p(MU)) / MU
+
+
+DICT_ENCODERS = {
+    "mulaw": encode_mulaw,
+    "int16": encode_int16,
+}
+
+
+class StreamListener:
+
+    def __init__(self, sid="", backlog=8):
+        self.sid = sid
+        self.deque_packets = deque(maxlen=backlog)
+        self.dropped = 0  # Packets pushed out of the backlog before they were sent
+
+
+class AudioStreamChannel:
+    """
+    Live audio for the listeners: every captured chunk is encoded once, numbered and queued per listener
+    in a small bounded backlog (a slow listener loses its oldest packets, never delays the others)
+    """
+
+    def __init__(self, rate=48000, stream_rate=12000, encoding="mulaw", backlog=8):
+        if encoding not in DICT_ENCODERS:
+            raise ValueError("Unknown audio encoding '{0}', expected one of: {1}".format(encoding, ", ".join(DICT_ENCODERS)))
+
+        self.rate = rate
+        self.factor = max(1, rate // stream_rate)
+        self.stream_rate = rate // self.factor
+        self.encoding = encoding
+        self.backlog = backlog
+
+        self.sequence = 0
+        self.dict_listeners = {}
+        self.condition = threading.Condition()
+
+    @property
+    def listener_count(self):
+        return len(self.dict_listeners)
+
+    def add_listener(self, sid=""):
+        with self.condition:
+            if sid not in self.dict_listeners:
+                self.dict_listeners[sid] = StreamListener(sid, self.backlog)
+
+    def remove_listener(self, sid=""):
+        with self.condition:
+            self.dict_listeners.pop(sid, None)
+
+    def publish(self, samples):
+        """
+        Called by the capture thread once per chunk
+        """
+        self.sequence += 1
+        if not self.dict_listeners:
+            return
+
+        packet = {
+            "seq": self.sequence,
+            "rate": self.stream_rate,
+            "encoding": self.encoding,
+            "chunk": DICT_ENCODERS[self.encoding](downsample(samples, self.factor)),
+        }
+
+        with self.condition:
+            for listener_ in self.dict_listeners.values():
+                if len(listener_.deque_packets) == listener_.deque_packets.maxlen:
+                    listener_.dropped += 1
+                listener_.deque_packets.append(packet)
+            self.condition.notify_all()
+
+    def get_packets(self, timeout=1.0):
+        """
+        Wait for new packets and take them out of the backlogs
+
+        @return list: [(sid, packet), ...] in sequence order per listener
+        """
+        with self.condition:
+            if not any(listener_.deque_packets for listener_ in self.dict_listeners.values()):
+                self.condition.wait(timeout)
+
+            lst_packets = []
+            for listener_ in self.dict_listeners.values():
+                while listener_.deque_packets:
+                    lst_packets.append((listener_.sid, listener_.deque_packets.popleft()))
+
+            return lst_packets
@@ -0,0 +1,187 @@
+import time
+import wave
+import cv2
+import numpy as np
+
+
+class Pacer:
+    """
+    Sleep between reads so a file or generated source delivers at the rate of the device it stands in for
+    """
+
+    def __init__(self, rate=0.0):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_time = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.time()
+        if self.next_time > now:
+            time.sleep(self.next_time - now)
+        self.next_time = max(self.next_time + self.interval, now)
+
+
+class FileVideoSource:
+    """
+    Frames of a video file, optionally looped, in place of the cv2.VideoCapture of the camera
+    """
+
+    def __init__(self, file_path="", loop=False, realtime=True):
+        self.file_path = file_path
+        self.loop = loop
+        self.video = cv2.VideoCapture(file_path)
+        if not self.video.isOpened():
+            raise IOError("Cannot open video file: {0}".format(file_path))
+
+        self.frame_rate = self.video.get(cv2.CAP_PROP_FPS) or 15
+        self.pacer = Pacer(self.frame_rate if realtime else 0.0)
+
+    def read(self, image=None):
+        self.pacer.wait()
+        grabbed, frame = self.video.read(image)
+        if not grabbed and self.loop:
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            grabbed, frame = self.video.read(image)
+        return grabbed, frame
+
+    def release(self):
+        self.video.release()
+
+
+class SyntheticVideoSource:
+    """
+    Noisy static scene with a block that moves for `motion_length` seconds out of every `period`
+    """
+
+    def __init__(self, width=640, height=480, frame_rate=15, count=0, period=20.0, motion_length=6.0, realtime=True, seed=0):
+        self.width = width
+        self.height = height
+        self.frame_rate = frame_rate
+        self.count = count  # Frames before the source ends, 0 for endless
+        self.period = period
+        self.motion_length = motion_length
+        self.pacer = Pacer(frame_rate if realtime else 0.0)
+        self.index = 0
+
+        rng = np.random.default_rng(seed)
+        self.background = cv2.GaussianBlur(rng.integers(40, 200, (height, width, 3), dtype=np.uint8), (31, 31), 0)
+        # A pool of sensor noise, generating it for every frame would cost more than the analysis
+        self.lst_noise = [rng.integers(0, 6, (height, width, 3), dtype=np.uint8) for _ in range(8)]
+
+    def read(self, image=None):
+        if self.count and self.index >= self.count:
+            return False, None
+
+        self.pacer.wait()
+
+        if image is None or image.shape != self.background.shape:
+            image = None
+        frame = cv2.add(self.background, self.lst_noise[self.index % len(self.lst_noise)], dst=image)
+        elapsed = (self.index / self.frame_rate) % self.period
+        x = self.width // 4
+        if elapsed < self.motion_length:
+            x += int((self.width // 2) * elapsed / self.motion_length)
+        cv2.rectangle(frame, (x, self.height // 3), (x + self.width // 6, self.height // 3 + self.height // 4), (230, 220, 210), -1)
+
+        self.index += 1
+        return True, frame
+
+    def release(self):
+        pass
+
+
+class AudioSource:
+    """
+    Same read() as a PyAudio input stream, in place of the microphone, over an array of samples.
+    Raises EOFError once it is used up.
+    """
+
+    def __init__(self, samples, rate=48000, channels=1, loop=False, realtime=True, dtype=np.float32):
+        self.samples = np.ascontiguousarray(samples, dtype=dtype).reshape(-1)
+        self.rate = rate
+        self.channels = channels
+        self.loop = loop
+        self.realtime = realtime
+        self.position = 0
+        self.next_time = 0.0
+
+    def read(self, num_frames, exception_on_overflow=True):
+        count = num_frames * self.channels
+
+        if self.position + count > len(self.samples):
+            if not self.loop or len(self.samples) < count:
+                raise EOFError("End of audio source")
+            self.position = 0
+
+        if self.realtime:
+            now = time.time()
+            if self.next_time > now:
+                time.sleep(self.next_time - now)
+            self.next_time = max(self.next_time + num_frames / self.rate, now)
+
+        chunk = self.samples[self.position:self.position + count].tobytes()
+        self.position += count
+        return chunk
+
+    def close(self):
+        pass
+
+
+def read_wav(file_path="", rate=48000, channels=1):
+    """
+    Samples of a PCM WAV file as float32 in -1 .. 1, mixed down / resampled to `rate` and `channels`
+    """
+    with wave.open(file_path, "rb") as f:
+        file_rate, file_channels, sample_width = f.getframerate(), f.getnchannels(), f.getsampwidth()
+        data = f.readframes(f.getnframes())
+
+    if sample_width == 2:
+        samples = np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768
+    elif sample_width == 4:
+        samples = np.frombuffer(data, dtype='<i4').astype(np.float32) / 2 ** 31
+    elif sample_width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    else:
+        raise ValueError("Unsupported sample width: {0} bytes".format(sample_width))
+
+    samples = samples.reshape(-1, file_channels).mean(axis=1)
+
+    if file_rate != rate:
+        positions = np.arange(int(len(samples) * rate / file_rate)) * file_rate / rate
+        samples = np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+    return np.repeat(samples[:, None], channels, axis=1).reshape(-1)
+
+
+class WavAudioSource(AudioSource):
+
+    def __init__(self, file_path="", rate=48000, channels=1, loop=False, realtime=True):
+        AudioSource.__init__(self, read_wav(file_path, rate, channels), rate, channels, loop, realtime)
+
+
+def get_tone_samples(seconds=60.0, rate=48000, period=20.0, cry_length=4.0, noise_level=0.005, seed=0, lead_in=5.0):
+    """
+    Background hiss with a cry-like tone (450 Hz with harmonics, wavering pitch) for `cry_length` seconds
+    out of every `period`, after `lead_in` seconds of hiss only (longer than the warm-up of
+    noise_floor.NoiseFloorTracker, which would otherwise calibrate on the cry)
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * rate)) / rate
+
+    samples = (noise_level * rng.standard_normal(len(t))).astype(np.float32)
+
+    is_crying = (t >= lead_in) & (((t - lead_in) % period) < cry_length)
+    phase = 2 * np.pi * np.cumsum(450 + 40 * np.sin(2 * np.pi * 3 * t)) / rate
+    tone = 0.2 * np.sin(phase) + 0.1 * np.sin(2 * phase) + 0.05 * np.sin(3 * phase)
+    samples[is_crying] += tone[is_crying].astype(np.float32)
+
+    return samples
+
+
+class SyntheticAudioSource(AudioSource):
+
+    def __init__(self, seconds=60.0, rate=48000, channels=1, period=20.0, cry_length=4.0, loop=False, realtime=True, seed=0,
+                 lead_in=5.0):
+        samples = get_tone_samples(seconds, rate, period, cry_length, seed=seed, lead_in=lead_in)
+        AudioSource.__init__(self, np.repeat(samples[:, None], channels, axis=1), rate, channels, loop, realtime)
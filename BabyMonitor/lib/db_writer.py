@@ -0,0 +1,104 @@
+import queue
+import threading
+import time
+from collections import deque
+
+from BabyMonitor.lib import utils
+
+
+class DbWriter(threading.Thread):
+    """
+    Write-behind for the measurement rows: add() only queues a row, this thread commits them in batches of at
+    most `batch_size` rows, at the latest `commit_interval` seconds after the first row of the batch.
+
+    The queue is bounded, rows added while it is full are dropped (and counted) so a stalled storage never
+    blocks the caller. `on_batch(rows)` is called with the rows of a batch in its session, e.g. to update the rollups.
+    """
+
+    def __init__(self, app=None, db=None, on_batch=None, queue_size=1000, batch_size=100, commit_interval=1.0, history_length=100):
+        threading.Thread.__init__(self, daemon=True)
+
+        self.name = str(self.__class__.__name__)
+        self.log_manager = utils.LogManager(self.name)
+
+        self.app = app
+        self.db = db
+        self.on_batch = on_batch
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+
+        self.queue = queue.Queue(queue_size)
+        self.lock = threading.Lock()
+        self.deque_batches = deque(maxlen=history_length)  # (rows, seconds to commit)
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def add(self, row):
+        try:
+            self.queue.put_nowait(row)
+            return True
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+
+    def get_batch(self):
+        lst_rows = [self.queue.get()]
+        deadline = time.time() + self.commit_interval
+
+        while len(lst_rows) < self.batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                lst_rows.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return lst_rows
+
+    def run(self):
+        while True:
+            lst_rows = self.get_batch()
+            self.write(lst_rows)
+
+    def write(self, lst_rows=()):
+        start = time.perf_counter()
+
+        with self.app.app_context():
+            try:
+                self.db.session.add_all(lst_rows)
+                if self.on_batch is not None:
+                    self.on_batch(lst_rows)
+                self.db.session.commit()
+            except Exception as e:
+                self.db.session.rollback()
+                with self.lock:
+                    self.failed += len(lst_rows)
+                self.log_manager.log("Error writing {0} rows: {1}".format(len(lst_rows), e))
+                return
+
+        with self.lock:
+            self.written += len(lst_rows)
+            self.deque_batches.append((len(lst_rows), time.perf_counter() - start))
+
+    def get_stats(self):
+        with self.lock:
+            lst_batches = list(self.deque_batches)
+            dict_stats = {"written": self.written, "dropped": self.dropped, "failed": self.failed}
+
+        lst_sizes = [size_ for size_, duration_ in lst_batches]
+        lst_durations = [duration_ for size_, duration_ in lst_batches]
+        dict_stats.update({
+            "queued": self.queue.qsize(),
+            "queue_size": self.queue_size,
+            "batch_size": self.batch_size,
+            "commit_interval": self.commit_interval,
+            "mean_batch": round(sum(lst_sizes) / len(lst_sizes), 1) if lst_sizes else 0.0,
+            "max_batch": max(lst_sizes) if lst_sizes else 0,
+            "mean_commit_ms": round(sum(lst_durations) * 1000 / len(lst_durations), 3) if lst_durations else 0.0,
+            "max_commit_ms": round(max(lst_durations) * 1000, 3) if lst_durations else 0.0,
+        })
+        return dict_stats
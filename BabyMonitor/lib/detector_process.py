@@ -0,0 +1,366 @@
+import abc
+import itertools
+import multiprocessing
+import queue
+import threading
+import numpy as np
+
+from BabyMonitor.lib import utils
+from BabyMonitor.lib import frame_broadcaster
+from BabyMonitor.lib import frame_bus
+from BabyMonitor.lib import audio_stream
+
+PATH_LENGTH = 1024
+SYNC_INTERVAL = 0.02  # Seconds between two updates of the shared state
+RECEIVE_INTERVAL = 1.0  # Seconds between two checks that the detector process is still alive
+CONTEXT = multiprocessing.get_context("spawn")  # No fork of a process that already runs threads
+
+
+class SharedState:
+    """
+    Detector state, written by the detector process and read by its proxy
+    """
+
+    def __init__(self):
+        self.value = CONTEXT.Value('d', 0.0, lock=False)
+        self.threshold = CONTEXT.Value('d', 0.0, lock=False)
+        self.active = CONTEXT.Value('b', 0, lock=False)
+        self.saved = CONTEXT.Value('b', 0, lock=False)
+        self.applied = CONTEXT.Value('Q', 0, lock=False)  # Last command applied by the detector process
+        self.current_file = CONTEXT.Array('c', PATH_LENGTH)
+        self.last_file = CONTEXT.Array('c', PATH_LENGTH)
+
+    def update(self, detector):
+        self.value.value = detector.value
+        self.threshold.value = getattr(detector, "threshold", 0.0)
+        self.active.value = detector.trigger.active
+        self.saved.value = detector.saved
+        self.current_file.value = detector.current_file.encode()[:PATH_LENGTH - 1]
+        self.last_file.value = detector.last_file.encode()[:PATH_LENGTH - 1]
+
+
+class ChunkChannel:
+    """
+    Audio chunks of the detector process, bounded: new chunks are dropped (and counted) when the proxy falls behind
+    """
+
+    def __init__(self, queue_size=64):
+        self.queue = CONTEXT.Queue(queue_size)
+        self.dropped = 0
+
+    def publish(self, samples):
+        # Same interface as AudioStreamChannel.publish, replaces the channel of the NoiseDetector
+        try:
+            self.queue.put_nowait(samples.tobytes())
+        except queue.Full:
+            self.dropped += 1
+
+
+def build_detector(kind, kwargs):
+    if kind == "motion":
+        from BabyMonitor.lib import motion_detector
+        return motion_detector.MotionDetector(**kwargs)
+    from BabyMonitor.lib import noise_detector
+    return noise_detector.NoiseDetector(**kwargs)
+
+
+def run_detector(kind, kwargs, state, conn, channel):
+    """
+    Entry point of a detector process: build the detector, report its properties, then apply the proxy's
+    commands and keep the shared state up to date until the detector stops
+    """
+    if kind == "motion":
+        kwargs = dict(kwargs, bus_signal=channel)  # New frames wake the proxy's reader
+    detector = build_detector(kind, kwargs)
+
+    if kind == "motion":
+        # Frames are read from the detector's frame bus
+        dict_info = {"frame_rate": detector.frame_rate, "width": detector.width, "height": detector.height,
+                     "bus_name": detector.bus.name}
+    else:
+        dict_info = {"RATE": detector.RATE, "CHANNELS": detector.CHANNELS, "CHUNK_SIZE": detector.CHUNK_SIZE,
+                     "DTYPE": np.dtype(detector.DTYPE).str, "preroll_length": detector.get_preroll_length()}
+        detector.audio_stream = channel
+
+    state.update(detector)
+    conn.send(("info", 0, dict_info))
+
+    lock = threading.Lock()
+    stopped = threading.Event()
+
+    def serve_commands():
+        while not stopped.is_set():
+            try:
+                command, sequence, name, value = conn.recv()
+            except (EOFError, OSError):
+                break  # The main process is gone
+
+            with lock:
+                if command == "start":
+                    detector.start()
+                elif command == "set":
+                    setattr(detector, name, value)
+                elif command == "call":
+                    conn.send(("result", sequence, getattr(detector, name)(*value)))
+                state.update(detector)
+                state.applied.value = sequence
+
+        stopped.set()
+
+    thread = threading.Thread(target=serve_commands, name="{0}-commands".format(detector.name), daemon=True)
+    thread.start()
+
+    while not stopped.wait(SYNC_INTERVAL):
+        with lock:
+            state.update(detector)
+        if detector.ident is not None and not detector.is_alive():
+            break
+
+    if kind == "motion":
+        detector.bus.close()
+
+
+class RemoteTrigger:
+
+    def __init__(self, state):
+        self.state = state
+
+    @property
+    def active(self):
+        return bool(self.state.active.value)
+
+
+def remote_attribute(name):
+    """
+    Attribute set on the detector in the other process, the last value set is read back locally
+    """
+    def getter(self):
+        return self.dict_attributes.get(name)
+
+    def setter(self, value):
+        with self.lock:
+            if self.dict_attributes.get(name) != value:
+                self.dict_attributes[name] = value
+                self.send("set", name, value)
+
+    return property(getter, setter)
+
+
+class DetectorProxy(abc.ABC):
+    """
+    Runs a detector in its own process (no GIL shared with the web server or the other detectors), with the
+    attributes the ThreadManager uses: state is read from shared memory, attributes set are sent as commands.
+    Frames come from the detector's frame bus, audio chunks through a queue.
+
+    Commands are applied by the detector process in the order the attributes were set, so a current_file set
+    before force_recording is always in place when the detector starts recording.
+    """
+
+    kind = ""
+
+    force_recording = remote_attribute("force_recording")
+    do_record = remote_attribute("do_record")
+    use_other_to_record = remote_attribute("use_other_to_record")
+
+    def __init__(self, **kwargs):
+        self.name = "{0}Process".format(self.kind.capitalize())
+        self.log_manager = utils.LogManager(self.name)
+        self.dict_attributes = {"force_recording": False, "do_record": kwargs.get("do_record", True),
+                                "use_other_to_record": False, "video_text": ""}
+
+        self.state = SharedState()
+        self.trigger = RemoteTrigger(self.state)
+        self.channel = self.get_channel()
+        self.conn, child_conn = CONTEXT.Pipe()
+        self.lock = threading.RLock()  # Held from setting an attribute to sending its command
+        self.sequence = itertools.count(1)
+        self.sent = 0  # Last command sent
+        self.pending_current_file = ""
+        self.current_file_sent = 0  # Command that set pending_current_file
+
+        self.process = CONTEXT.Process(target=run_detector, name=self.name, daemon=True,
+                                       args=(self.kind, kwargs, self.state, child_conn, self.channel))
+        self.process.start()
+        child_conn.close()  # Only the detector process holds it now: its exit ends self.conn with an EOF
+
+        # Properties of the devices, known once the detector process has opened them
+        self.info = self.receive(0)
+        self.log_manager.log("Started process {0}".format(self.process.pid))
+
+        self.thread = threading.Thread(target=self.run_channel, name="{0}-channel".format(self.name), daemon=True)
+
+    @abc.abstractmethod
+    def get_channel(self):
+        """
+        @return object: shared with the detector process at start, where its output comes from
+        """
+
+    @abc.abstractmethod
+    def run_channel(self):
+        """
+        Thread of the proxy, hands the output of the detector process to the local consumers
+        """
+
+    def send(self, command="set", name="", value=None):
+        with self.lock:
+            self.sent = next(self.sequence)
+            self.conn.send((command, self.sent, name, value))
+            return self.sent
+
+    def receive(self, sequence=0):
+        # Polled, a detector process that died (e.g. while starting) must not block the caller forever
+        while True:
+            try:
+                if not self.conn.poll(RECEIVE_INTERVAL):
+                    if self.process.is_alive():
+                        continue
+                    break
+                command, sequence_, value = self.conn.recv()
+            except (EOFError, OSError):
+                break
+
+            if sequence_ == sequence:
+                return value
+
+        self.process.join(RECEIVE_INTERVAL)
+        raise RuntimeError("{0} exited (exit code {1})".format(self.name, self.process.exitcode))
+
+    def call(self, name="", *args):
+        """
+        Call a method of the detector and wait for its result
+        """
+        with self.lock:
+            self.sent = next(self.sequence)
+            self.conn.send(("call", self.sent, name, args))
+            return self.receive(self.sent)
+
+    def start(self):
+        self.thread.start()
+        self.send("start")
+
+    def join(self, timeout=None):
+        self.process.join(timeout)
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    @property
+    def ident(self):
+        return self.process.pid
+
+    @property
+    def value(self):
+        return self.state.value.value
+
+    @property
+    def saved(self):
+        return bool(self.state.saved.value)
+
+    @property
+    def current_file(self):
+        # Until the detector process applied it, the file set last
+        if self.state.applied.value < self.current_file_sent:
+            return self.pending_current_file
+        return self.state.current_file.value.decode()
+
+    @current_file.setter
+    def current_file(self, value):
+        with self.lock:
+            self.pending_current_file = value
+            self.current_file_sent = self.send("set", "current_file", value)
+
+    @property
+    def last_file(self):
+        return self.state.last_file.value.decode()
+
+    @property
+    def external_writer(self):
+        return None
+
+    @external_writer.setter
+    def external_writer(self, value):
+        raise TypeError("Writers cannot be handed to a detector process")
+
+    def get_stats(self):
+        return self.call("get_stats")
+
+
+class MotionDetectorProxy(DetectorProxy):
+
+    kind = "motion"
+
+    video_text = remote_attribute("video_text")
+
+    def __init__(self, **kwargs):
+        DetectorProxy.__init__(self, **kwargs)
+        self.frame_rate = self.info["frame_rate"]
+        self.width = self.info["width"]
+        self.height = self.info["height"]
+        self.broadcaster = frame_broadcaster.FrameBroadcaster()
+
+    def get_channel(self):
+        # Shared with the frame bus of the detector process, signalled on every frame
+        return frame_bus.FrameSignal()
+
+    def run_channel(self):
+        # Frames of the detector process go to a local broadcaster for the /videostream clients, without a copy
+        bus = frame_bus.FrameBus(self.info["bus_name"], signal=self.channel)
+        sequence = 0
+        while self.process.is_alive():
+            frame_ref = bus.wait_for_frame(sequence)
+            if frame_ref is not None:
+                sequence = frame_ref.sequence
+                self.broadcaster.publish(frame_ref.frame, frame_ref.timestamp, frame_ref.is_valid)
+        bus.close()
+
+    @property
+    def detect_motion(self):
+        return self.trigger.active
+
+    def get_frame(self):
+        return self.broadcaster.get_jpeg()
+
+    def get_stats(self):
+        dict_stats = DetectorProxy.get_stats(self)
+        dict_stats.update(self.broadcaster.get_stats())
+        return dict_stats
+
+
+class NoiseDetectorProxy(DetectorProxy):
+
+    kind = "noise"
+
+    def __init__(self, **kwargs):
+        DetectorProxy.__init__(self, **kwargs)
+        self.RATE = self.info["RATE"]
+        self.CHANNELS = self.info["CHANNELS"]
+        self.CHUNK_SIZE = self.info["CHUNK_SIZE"]
+        self.DTYPE = np.dtype(self.info["DTYPE"])
+        self.audio_stream = audio_stream.AudioStreamChannel(self.RATE)
+        self.chunk = None
+
+    def get_channel(self):
+        return ChunkChannel()
+
+    def run_channel(self):
+        # Chunks of the detector process go to a local stream channel, for the Socket.IO listeners
+        while self.process.is_alive():
+            try:
+                self.chunk = self.channel.queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            self.audio_stream.publish(np.frombuffer(self.chunk, dtype=self.DTYPE))
+
+    @property
+    def threshold(self):
+        return self.state.threshold.value
+
+    @property
+    def detect_noise(self):
+        return self.trigger.active
+
+    def get_chunk(self):
+        return self.chunk
+
+    def get_preroll_length(self):
+        return self.info["preroll_length"]
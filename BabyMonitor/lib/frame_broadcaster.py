@@ -0,0 +1,93 @@
+import threading
+import time
+import cv2
+
+
+class FrameBroadcaster:
+    """
+    Latest captured frame for any number of viewers
+
+    Every published frame gets a version number. It is JPEG-encoded at most once, by the first viewer that
+    asks for it, and viewers block until a newer version exists. A slow viewer simply gets the newest frame
+    next time, skipped frames are never queued.
+    """
+
+    def __init__(self, quality=80):
+        self.params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+
+        self.condition = threading.Condition()
+        self.encode_lock = threading.Lock()
+
+        self.frame = None
+        self.is_valid = None
+        self.version = 0
+        self.timestamp = 0.0
+
+        self.jpeg = None
+        self.jpeg_version = 0
+        self.jpeg_timestamp = 0.0
+        self.encoded_count = 0
+
+        # Capture to delivery latency of the frames handed to viewers, in seconds
+        self.latency = 0.0  # Exponential moving average
+        self.max_latency = 0.0
+        self.delivered_count = 0
+
+    def publish(self, frame, timestamp=None, is_valid=None):
+        """
+        Called by the capture thread, `frame` must not be modified afterwards
+
+        @param callable is_valid: for a frame that is a view into a frame_bus slot, False once it was reused
+        """
+        with self.condition:
+            self.frame = frame
+            self.is_valid = is_valid
+            self.timestamp = time.time() if timestamp is None else timestamp
+            self.version += 1
+            self.condition.notify_all()
+
+    def encode(self):
+        with self.encode_lock:
+            with self.condition:
+                frame, version, timestamp, is_valid = self.frame, self.version, self.timestamp, self.is_valid
+
+            if frame is not None and self.jpeg_version != version:
+                ret, jpeg = cv2.imencode('.jpg', frame, self.params)
+                if ret and (is_valid is None or is_valid()):
+                    self.jpeg = jpeg.tobytes()
+                    self.jpeg_version = version
+                    self.jpeg_timestamp = timestamp
+                    self.encoded_count += 1
+
+            return self.jpeg_version, self.jpeg
+
+    def get_jpeg(self):
+        return self.encode()[1]
+
+    def wait_for_frame(self, version=0, timeout=1.0):
+        """
+        Block until a frame newer than `version` exists
+
+        @return tuple: (version, jpeg bytes), jpeg is None on timeout
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.version > version, timeout):
+                return version, None
+
+        version, jpeg = self.encode()
+        self.add_latency(time.time() - self.jpeg_timestamp)
+        return version, jpeg
+
+    def add_latency(self, latency=0.0):
+        self.delivered_count += 1
+        self.latency = latency if self.delivered_count == 1 else 0.9 * self.latency + 0.1 * latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def get_stats(self):
+        return {
+            "published": self.version,
+            "encoded": self.encoded_count,
+            "delivered": self.delivered_count,
+            "latency_ms": round(self.latency * 1000, 1),
+            "max_latency_ms": round(self.max_latency * 1000, 1),
+        }
@@ -0,0 +1,216 @@
+import os
+import multiprocessing
+import threading
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+MAGIC = 0x46425553  # "FBUS"
+ALIGNMENT = 64
+
+BUS_HEADER = np.dtype([("magic", "<u4"), ("slot_count", "<u4"), ("slot_size", "<u8"), ("latest", "<u8")])
+SLOT_HEADER = np.dtype([("version", "<u8"), ("sequence", "<u8"), ("timestamp", "<f8"), ("shape", "<u4", (3,))])
+
+
+def align(size):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class FrameRef:
+    """
+    Zero-copy view of a published frame. The slot is reused `slot_count` frames later: check is_valid()
+    after reading the view, or use copy().
+    """
+
+    def __init__(self, bus, index, version, sequence, timestamp, frame):
+        self.bus = bus
+        self.index = index
+        self.version = version
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.frame = frame
+
+    def is_valid(self):
+        return self.bus.get_version(self.index) == self.version
+
+    def copy(self):
+        """
+        @return numpy-Array: copy of the frame, None if the slot was reused meanwhile
+        """
+        frame = self.frame.copy()
+        return frame if self.is_valid() else None
+
+
+class FrameSignal:
+    """
+    Wakes the reader of a frame bus in another process without ever blocking the writer: every commit writes
+    one byte into a non-blocking pipe, a full pipe means a wakeup is pending anyway. Created before the
+    processes start and handed to both, for a single reader.
+    """
+
+    def __init__(self):
+        self.reader, self.writer = multiprocessing.Pipe(duplex=False)
+        os.set_blocking(self.writer.fileno(), False)  # Shared with the inherited descriptors
+
+    def notify(self):
+        try:
+            os.write(self.writer.fileno(), b"\0")
+        except (BlockingIOError, BrokenPipeError):
+            pass
+
+    def wait(self, timeout=1.0):
+        """
+        Block until notified or `timeout` seconds passed, the wakeups pending are consumed
+        """
+        if self.reader.poll(timeout):
+            os.read(self.reader.fileno(), 4096)
+
+
+class FrameBus:
+    """
+    Ring of frame slots in one shared memory block, a single writer and any number of readers in any process
+
+    Every slot has a header (version, sequence, timestamp, shape). The version is a seqlock: odd while the
+    slot is written, so readers never block the writer and detect a reused slot by a changed version.
+    Readers attach by name, all sizes are in the block's own header. A reader in another process blocks in
+    wait_for_frame() on a FrameSignal shared with the writer, without one it polls.
+    """
+
+    def __init__(self, name=None, shape=(480, 640, 3), slot_count=8, signal=None):
+        self.owner = name is None
+
+        if self.owner:
+            slot_size = align(int(np.prod(shape)))
+            header_size = align(BUS_HEADER.itemsize) + align(SLOT_HEADER.itemsize * slot_count)
+            self.shm = shared_memory.SharedMemory(create=True, size=header_size + slot_size * slot_count)
+        else:
+            try:
+                # Only the owner removes the block (Python 3.13+)
+                self.shm = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                # Registered with the resource tracker, which child processes share with their parent
+                self.shm = shared_memory.SharedMemory(name=name)
+
+        self.header = np.ndarray((), dtype=BUS_HEADER, buffer=self.shm.buf)
+        if self.owner:
+            self.header["magic"], self.header["slot_count"], self.header["slot_size"], self.header["latest"] = MAGIC, slot_count, slot_size, 0
+        elif self.header["magic"] != MAGIC:
+            raise ValueError("Shared memory {0} is not a frame bus".format(name))
+
+        self.slot_count = int(self.header["slot_count"])
+        self.slot_size = int(self.header["slot_size"])
+
+        self.slots = np.ndarray((self.slot_count,), dtype=SLOT_HEADER, buffer=self.shm.buf, offset=align(BUS_HEADER.itemsize))
+        self.data_offset = align(BUS_HEADER.itemsize) + align(SLOT_HEADER.itemsize * self.slot_count)
+        if self.owner:
+            self.slots.fill(0)
+
+        self.sequence = int(self.header["latest"])
+        self.writing = -1  # Slot acquired by the writer
+        self.signal = signal
+        self.condition = threading.Condition()  # Notified on every commit, for the readers of the writer's process
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def get_version(self, index):
+        return int(self.slots["version"][index])
+
+    def get_view(self, index, shape):
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=self.data_offset + index * self.slot_size)
+
+    def acquire(self, shape):
+        """
+        Writer: the next slot to fill in place, readers of its previous frame see it invalidated from now on
+
+        @return numpy-Array
+        """
+        if int(np.prod(shape)) > self.slot_size:
+            raise ValueError("Frame of shape {0} does not fit the bus slots".format(shape))
+
+        self.writing = (self.sequence + 1) % self.slot_count
+        self.slots["version"][self.writing] += 1  # Odd: being written
+        self.slots["shape"][self.writing] = tuple(shape) + (1,) * (3 - len(shape))
+        return self.get_view(self.writing, shape)
+
+    def abort(self):
+        """
+        Writer: give the acquired slot up without publishing it
+        """
+        if self.writing >= 0:
+            self.slots["version"][self.writing] += 1
+            self.writing = -1
+
+    def commit(self, timestamp=0.0):
+        """
+        Writer: publish the acquired slot
+        """
+        self.sequence += 1
+        slot = self.slots[self.writing]
+        slot["sequence"], slot["timestamp"] = self.sequence, timestamp
+        self.slots["version"][self.writing] += 1  # Even: complete
+        self.header["latest"] = self.sequence
+        self.writing = -1
+
+        with self.condition:
+            self.condition.notify_all()
+        if self.signal is not None:
+            self.signal.notify()
+
+        return self.sequence
+
+    def publish(self, frame, timestamp=0.0):
+        np.copyto(self.acquire(frame.shape), frame)
+        return self.commit(timestamp)
+
+    @property
+    def latest(self):
+        return int(self.header["latest"])
+
+    def get_latest(self):
+        """
+        @return FrameRef: the newest complete frame, None if there is none yet
+        """
+        for retry_ in range(3):
+            sequence = self.latest
+            if not sequence:
+                return None
+
+            index = sequence % self.slot_count
+            version = self.get_version(index)
+            slot = self.slots[index]
+            if version % 2 == 0 and int(slot["sequence"]) == sequence:
+                shape = tuple(int(size_) for size_ in slot["shape"])
+                frame_ref = FrameRef(self, index, version, sequence, float(slot["timestamp"]), self.get_view(index, shape[:2] if shape[2] == 1 else shape))
+                if frame_ref.is_valid():
+                    return frame_ref
+        return None
+
+    def wait_for_frame(self, sequence=0, timeout=1.0, poll_interval=0.002):
+        """
+        Block until a frame newer than `sequence` exists
+
+        @return FrameRef: None on timeout
+        """
+        deadline = time.time() + timeout
+        if self.owner:
+            with self.condition:
+                self.condition.wait_for(lambda: self.latest > sequence, timeout)
+        elif self.signal is not None:
+            while self.latest <= sequence and time.time() < deadline:
+                self.signal.wait(deadline - time.time())
+        else:
+            while self.latest <= sequence and time.time() < deadline:
+                time.sleep(poll_interval)
+
+        return self.get_latest() if self.latest > sequence else None
+
+    def close(self):
+        self.header = self.slots = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # Frame views still referenced, the mapping goes away with them
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,95 @@
+import threading
+import time
+
+
+class FrameGrabber(threading.Thread):
+    """
+    Read the capture device as fast as it delivers, straight into the slots of a frame_bus.FrameBus
+
+    The driver buffer is drained continuously, so consumers never get stale frames however slow they are.
+    `overlay(frame)` may draw on a frame before it is published, `on_frame(frame_ref)` is called in this
+    thread for every published frame (streaming, recording) and must not block.
+    """
+
+    def __init__(self, video=None, bus=None, overlay=None, on_frame=None):
+        threading.Thread.__init__(self, daemon=True)
+
+        self.name = str(self.__class__.__name__)
+        self.video = video
+        self.bus = bus
+        self.overlay = overlay
+        self.on_frame = on_frame
+
+        self.condition = threading.Condition()
+        self.frame_ref = None
+        self.stopped = False
+        self.shape = None
+
+        self.started_at = 0.0
+
+    def run(self):
+        self.started_at = time.time()
+
+        while True:
+            if self.shape is None:
+                grabbed, frame = self.video.read()
+                slot = frame
+            else:
+                slot = self.bus.acquire(self.shape)
+                grabbed, frame = self.video.read(slot)
+            timestamp = time.time()
+
+            if not grabbed:
+                self.bus.abort()
+                break
+
+            if frame is not slot or self.shape is None:
+                # First frame, or the device did not read into the slot
+                self.bus.abort()
+                self.shape = frame.shape
+                slot = self.bus.acquire(self.shape)
+                slot[...] = frame
+
+            if self.overlay is not None:
+                self.overlay(slot)
+            self.bus.commit(timestamp)
+
+            frame_ref = self.bus.get_latest()
+            if self.on_frame is not None:
+                self.on_frame(frame_ref)
+
+            with self.condition:
+                self.frame_ref = frame_ref
+                self.condition.notify_all()
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    @property
+    def sequence(self):
+        return self.bus.sequence
+
+    def wait_for_frame(self, sequence=0, timeout=1.0):
+        """
+        Block until a frame newer than `sequence` exists
+
+        @return frame_bus.FrameRef: None on timeout or when the capture stopped
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence > sequence or self.stopped, timeout)
+            frame_ref = self.frame_ref
+
+        return frame_ref if frame_ref is not None and frame_ref.sequence > sequence else None
+
+    @property
+    def fps(self):
+        elapsed = time.time() - self.started_at if self.started_at else 0.0
+        return self.sequence / elapsed if elapsed > 0 else 0.0
+
+    def get_stats(self):
+        return {
+            "grabbed": self.sequence,
+            "grab_fps": round(self.fps, 2),
+            "stopped": self.stopped,
+        }
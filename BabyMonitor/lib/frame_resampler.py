@@ -0,0 +1,113 @@
+import numpy as np
+
+
+def resample_indices(timestamps, frame_rate=15):
+    """
+    Index of the closest captured frame for every slot of a constant frame rate, vectorized
+
+    Slots run every 1 / frame_rate seconds from the first to the last timestamp, ties go to the earlier frame.
+
+    @param numpy-Array timestamps: increasing capture timestamps
+    @return numpy-Array
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if not len(timestamps):
+        return np.empty(0, dtype=np.intp)
+
+    offsets = timestamps - timestamps[0]
+    slots = np.arange(int(np.floor(offsets[-1] * frame_rate)) + 1) / frame_rate
+
+    after = np.clip(np.searchsorted(offsets, slots, side="left"), 0, len(offsets) - 1)
+    before = np.clip(after - 1, 0, len(offsets) - 1)
+
+    use_before = np.abs(slots - offsets[before]) <= np.abs(offsets[after] - slots)
+    return np.where(use_before, before, after)
+
+
+def get_resample_stats(indices, frame_count=0):
+    """
+    @return dict: captured and written frame counts, frames written more than once and frames never written
+    """
+    counts = np.bincount(indices, minlength=frame_count) if len(indices) else np.zeros(frame_count, dtype=np.intp)
+    return {
+        "captured": int(frame_count),
+        "written": int(len(indices)),
+        "duplicated": int(np.maximum(counts - 1, 0).sum()),
+        "dropped": int(np.count_nonzero(counts == 0)),
+    }
+
+
+class FrameResampler:
+    """
+    Streaming version of resample_indices: two pointers over the incoming timestamps and the output slots,
+    O(1) amortized per frame
+    """
+
+    def __init__(self, frame_rate=15):
+        self.time_step = 1.0 / frame_rate
+
+        self.zero_timestamp = None
+        self.previous_timestamp = None
+        self.previous_frame = None
+        self.previous_count = 0  # Slots given to the previous frame so far
+        self.slot = 0
+
+        self.captured = 0
+        self.written = 0
+        self.duplicated = 0
+        self.dropped = 0
+
+    def get_stats(self):
+        return {
+            "captured": self.captured,
+            "written": self.written,
+            "duplicated": self.duplicated,
+            "dropped": self.dropped,
+        }
+
+    def emit_until(self, offset=0.0):
+        lst_frames = []
+        while self.slot * self.time_step <= offset:
+            lst_frames.append(self.previous_frame)
+            self.previous_count += 1
+            self.slot += 1
+        self.written += len(lst_frames)
+        return lst_frames
+
+    def retire_previous(self):
+        if self.previous_count == 0:
+            self.dropped += 1
+        else:
+            self.duplicated += self.previous_count - 1
+
+    def push(self, timestamp, frame):
+        """
+        @return list: frames to write for the slots that are now decided
+        """
+        self.captured += 1
+        lst_frames = []
+
+        if self.zero_timestamp is None:
+            self.zero_timestamp = timestamp
+        else:
+            # Slots closer to the previous frame than to this one get the previous frame
+            lst_frames = self.emit_until((self.previous_timestamp + timestamp) / 2 - self.zero_timestamp)
+            self.retire_previous()
+
+        self.previous_timestamp, self.previous_frame = timestamp, frame
+        self.previous_count = 0
+
+        return lst_frames
+
+    def flush(self):
+        """
+        @return list: frames for the remaining slots up to the last timestamp
+        """
+        if self.previous_frame is None:
+            return []
+
+        lst_frames = self.emit_until(self.previous_timestamp - self.zero_timestamp)
+        self.retire_previous()
+        self.previous_frame = None
+
+        return lst_frames
@@ -0,0 +1,256 @@
+import time
+import cv2
+import numpy as np
+
+from BabyMonitor.lib import motion_zones
+
+STAGES = ("resize", "gray", "blur", "delta", "threshold", "dilate", "count")
+
+
+def get_odd(value=1.0):
+    value = max(1, int(round(value)))
+    return value if value % 2 else value + 1
+
+
+class MotionAnalyzer:
+    """
+    Frame differencing on a downsampled (and optionally cropped) copy of the frame: every blurred frame is
+    compared with the previous one
+
+    With zones (motion_zones.MotionZone) only their bounding rectangle is analysed, the result is the motion
+    percentage of the zones together and zone_values holds the percentage of every zone.
+
+    The blur and dilation are scaled with the frame, and the motion percentage is relative to the analysed
+    pixels, so values stay comparable to a full resolution analysis. Intermediate buffers and the kernel
+    are allocated once per input resolution.
+    """
+
+    name = "frame_diff"
+
+    def __init__(self, scale=0.5, roi=None, blur_size=21, delta_threshold=15, dilate_iterations=4, zones=None):
+        self.scale = scale
+        self.roi = roi  # (x, y, width, height) in full resolution pixels, None for the whole frame
+        self.zones = list(zones or [])
+        self.zone_index = None
+        self.zone_values = np.zeros(len(self.zones))
+        self.crop = None
+        self.delta_threshold = delta_threshold
+
+        self.blur_size = get_odd(blur_size * scale)
+        self.dilate_iterations = max(1, int(round(dilate_iterations * scale)))
+        self.kernel = np.ones((5, 5), np.uint8)
+
+        self.input_shape = None
+        self.size = (0, 0)
+        self.has_previous = False
+        self.profile = False
+        self.dict_stage_times = dict.fromkeys(STAGES, 0.0)
+        self.frame_count = 0
+        self.last_tick = 0.0
+
+    def allocate(self, shape):
+        height, width = shape[:2]
+        self.crop = None
+        if self.zones:
+            self.crop = motion_zones.get_bounding_rect(self.zones, shape)
+        elif self.roi:
+            self.crop = self.get_roi(shape)
+        if self.crop:
+            x, y, width, height = self.crop
+
+        self.size = (max(1, int(width * self.scale)), max(1, int(height * self.scale)))
+        small_shape = (self.size[1], self.size[0])
+
+        self.zone_index = None
+        if self.zones:
+            self.zone_index = motion_zones.ZoneIndex(self.zones, offset=self.crop[:2],
+                                                     scale=(self.size[0] / width, self.size[1] / height), size=self.size)
+
+        self.small = np.empty(small_shape + tuple(shape[2:]), dtype=np.uint8)
+        self.gray = np.empty(small_shape, dtype=np.uint8)
+        self.blurs = [np.empty(small_shape, dtype=np.uint8), np.empty(small_shape, dtype=np.uint8)]
+        self.delta = np.empty(small_shape, dtype=np.uint8)
+        self.thresholded = np.empty(small_shape, dtype=np.uint8)
+        self.dilated = np.empty(small_shape, dtype=np.uint8)
+
+        self.input_shape = shape
+        self.has_previous = False
+
+    def get_roi(self, shape):
+        x, y, width, height = self.roi
+        x = min(max(0, x), shape[1] - 1)
+        y = min(max(0, y), shape[0] - 1)
+        return x, y, min(width, shape[1] - x), min(height, shape[0] - y)
+
+    def reset(self):
+        self.has_previous = False
+        self.dict_stage_times = dict.fromkeys(STAGES, 0.0)
+        self.frame_count = 0
+
+    def get_stage_times(self):
+        """
+        @return dict: average milliseconds per frame for every stage
+        """
+        count = max(1, self.frame_count)
+        return {stage: total * 1000 / count for stage, total in self.dict_stage_times.items()}
+
+    def tick(self, stage=""):
+        if self.profile:
+            now = time.perf_counter()
+            self.dict_stage_times[stage] += now - self.last_tick
+            self.last_tick = now
+
+    def process(self, frame):
+        """
+        @param numpy-Array frame: full resolution BGR frame
+        @return float: motion percentage, None for the first frame
+        """
+        if frame.shape != self.input_shape:
+            self.allocate(frame.shape)
+
+        if self.crop:
+            x, y, width, height = self.crop
+            frame = frame[y:y + height, x:x + width]
+
+        self.last_tick = time.perf_counter() if self.profile else 0.0
+
+        if self.scale != 1.0:
+            cv2.resize(frame, self.size, dst=self.small, interpolation=cv2.INTER_LINEAR)
+            frame = self.small
+        self.tick("resize")
+
+        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        self.tick("gray")
+
+        current = self.blurs[0]
+        cv2.GaussianBlur(self.gray, (self.blur_size, self.blur_size), 0, dst=current)
+        self.tick("blur")
+
+        if not self.compare(current):
+            return None
+
+        cv2.dilate(self.thresholded, self.kernel, dst=self.dilated, iterations=self.dilate_iterations)
+        self.tick("dilate")
+
+        if self.zone_index is not None:
+            motion_percentage, self.zone_values = self.zone_index.measure(self.dilated)
+        else:
+            motion_percentage = (cv2.countNonZero(self.dilated) * 100) / self.dilated.size
+        self.tick("count")
+
+        self.frame_count += 1
+
+        return motion_percentage
+
+    def compare(self, current):
+        """
+        Fill self.thresholded with the changed pixels of the blurred frame `current`
+
+        @return bool: False while there is nothing to compare with yet
+        """
+        previous = self.blurs[1]
+
+        # The current blur becomes the previous one
+        self.blurs.reverse()
+
+        if not self.has_previous:
+            self.has_previous = True
+            return False
+
+        cv2.absdiff(previous, current, dst=self.delta)
+        self.tick("delta")
+
+        cv2.threshold(self.delta, self.delta_threshold, 255, cv2.THRESH_BINARY, dst=self.thresholded)
+        self.tick("threshold")
+
+        return True
+
+
+class RunningAverageAnalyzer(MotionAnalyzer):
+    """
+    Every blurred frame is compared with a running average of the previous ones, updated in place with
+    cv2.accumulateWeighted. Slow motion keeps adding up against the background instead of cancelling out
+    frame to frame, and the background is scaled to the frame's mean brightness first, so auto-exposure
+    changes do not light up the whole frame.
+    """
+
+    name = "running_average"
+
+    def __init__(self, scale=0.5, roi=None, blur_size=21, delta_threshold=15, dilate_iterations=4, zones=None,
+                 alpha=0.05, compensate_exposure=True):
+        MotionAnalyzer.__init__(self, scale, roi, blur_size, delta_threshold, dilate_iterations, zones)
+        self.alpha = alpha  # Weight of the newest frame in the background
+        self.compensate_exposure = compensate_exposure
+
+    def allocate(self, shape):
+        MotionAnalyzer.allocate(self, shape)
+        self.background = np.empty(self.gray.shape, dtype=np.float32)
+        self.background_u8 = np.empty(self.gray.shape, dtype=np.uint8)
+
+    def compare(self, current):
+        if not self.has_previous:
+            self.has_previous = True
+            self.background[:] = current
+            return False
+
+        gain = 1.0
+        if self.compensate_exposure:
+            background_mean = cv2.mean(self.background)[0]
+            if background_mean > 0:
+                gain = cv2.mean(current)[0] / background_mean
+
+        cv2.convertScaleAbs(self.background, dst=self.background_u8, alpha=gain)
+        cv2.absdiff(self.background_u8, current, dst=self.delta)
+        self.tick("delta")
+
+        cv2.threshold(self.delta, self.delta_threshold, 255, cv2.THRESH_BINARY, dst=self.thresholded)
+        self.tick("threshold")
+
+        cv2.accumulateWeighted(current, self.background, self.alpha)
+
+        return True
+
+
+class Mog2Analyzer(MotionAnalyzer):
+    """
+    Mixture of Gaussians background model per pixel (cv2.BackgroundSubtractorMOG2) on the blurred frame
+    """
+
+    name = "mog2"
+
+    def __init__(self, scale=0.5, roi=None, blur_size=21, delta_threshold=15, dilate_iterations=4, zones=None,
+                 history=500, var_threshold=16, learning_rate=0.005):
+        MotionAnalyzer.__init__(self, scale, roi, blur_size, delta_threshold, dilate_iterations, zones)
+        self.history = history
+        self.var_threshold = var_threshold  # Squared distance to a Gaussian, in variances, that counts as motion
+        self.learning_rate = learning_rate
+        self.subtractor = None
+
+    def allocate(self, shape):
+        MotionAnalyzer.allocate(self, shape)
+        self.subtractor = cv2.createBackgroundSubtractorMOG2(self.history, self.var_threshold, False)
+
+    def reset(self):
+        MotionAnalyzer.reset(self)
+        self.input_shape = None  # Start a new model
+
+    def compare(self, current):
+        if not self.has_previous:
+            self.has_previous = True
+            self.subtractor.apply(current, learningRate=1.0)
+            return False
+
+        self.subtractor.apply(current, fgmask=self.thresholded, learningRate=self.learning_rate)
+        self.tick("delta")
+        self.tick("threshold")
+
+        return True
+
+
+DICT_ENGINES = {engine_.name: engine_ for engine_ in (MotionAnalyzer, RunningAverageAnalyzer, Mog2Analyzer)}
+
+
+def get_engine(name="frame_diff", **kwargs):
+    if name not in DICT_ENGINES:
+        raise ValueError("Unknown motion engine '{0}', expected one of: {1}".format(name, ", ".join(DICT_ENGINES)))
+    return DICT_ENGINES[name](**kwargs)
@@ -2,18 +2,23 @@ import os
 import threading
 import cv2
 import datetime
-from collections import deque
 import time
-import math
 import numpy as np
-import subprocess
 
 from BabyMonitor.lib import utils
+from BabyMonitor.lib import trigger
+from BabyMonitor.lib import frame_broadcaster
+from BabyMonitor.lib import frame_grabber
+from BabyMonitor.lib import frame_bus
+from BabyMonitor.lib import motion_analysis
+from BabyMonitor.lib import video_writer
+from BabyMonitor.lib import transcoder
 
 
 class MotionDetector(threading.Thread):
 
-    def __init__(self, video_capture_source=None, do_record=True, do_convert=True):
+    def __init__(self, video_capture_source=None, do_record=True, do_convert=True, analysis_scale=0.5, analysis_roi=None,
+                 analysis_rate=0, engine="frame_diff", zones=None, bus_signal=None):
         threading.Thread.__init__(self)
 
         self.name = str(self.__class__.__name__)
@@ -23,32 +28,45 @@ class MotionDetector(threading.Thread):
 
         self.current_file = ""
         self.last_file = ""
-        self.current_frame = None
+        self.current_frame = None  # View into a frame bus slot, only valid until the slot is reused
         self.current_timestamp = time.time()
+        self.broadcaster = frame_broadcaster.FrameBroadcaster()
 
         self.video = video_capture_source if video_capture_source else self.get_video_capture()
         self.frame_rate = 15
-        self.fps = 0
         self.height, self.width = self.get_resolutions()
 
         self.threshold = 7
+        self.BUS_SLOTS = 8  # Frames kept in the shared memory ring, how late a reader may be
+        self.analyzer = motion_analysis.get_engine(engine, scale=analysis_scale, roi=analysis_roi, zones=zones)
+        self.analysis_rate = analysis_rate or self.frame_rate  # Frames analysed per second, at most
+        self.analysed_count = 0
+        self.analysis_dropped = 0  # Grabbed frames the analysis skipped
+        self.analysis_invalid = 0  # Analysed frames whose slot was reused before the analysis finished
+
+        # Capture runs in its own thread, frames are read into a shared memory ring that streaming, recording
+        # and analysis (in this or other processes) read without copying
+        self.bus = frame_bus.FrameBus(shape=(self.height, self.width, 3), slot_count=self.BUS_SLOTS, signal=bus_signal)
+        self.grabber = frame_grabber.FrameGrabber(self.video, self.bus, self.draw_overlay, self.on_frame)
+        self.writer_lock = threading.Lock()
 
         self.do_record = do_record
         self.do_convert = do_convert
         self.video_text = ""
-        self.detect_motion = False
+        self.trigger = trigger.SlidingWindowTrigger(utils.OBSERVER_LENGTH * self.analysis_rate)
         self.writer = None
+        self.external_writer = None  # Writer handed over by the ThreadManager for the next record (piped mode)
         self.use_other_to_record = False
         self.force_recording = False
         self.saved = False
         self._value = 0.0
 
         self.codec = cv2.VideoWriter_fourcc(*'MJPG')
-
-        self.record = []
+        self.transcoder = transcoder.get_default_queue()
 
     def __del__(self):
         self.video.release()
+        self.bus.close()
 
     def start_recording(self):
 
@@ -61,7 +79,13 @@ class MotionDetector(threading.Thread):
             if not os.path.exists(dst_dir):
                 os.makedirs(dst_dir)
 
-            # self.writer = cv2.VideoWriter(self.current_file, self.codec, self.frame_rate, (self.width, self.height))
+            if self.external_writer is not None:
+                writer, self.external_writer = self.external_writer, None
+            else:
+                writer = video_writer.BackgroundVideoWriter(self.current_file, self.codec, self.frame_rate, (self.width, self.height))
+
+            with self.writer_lock:
+                self.writer = writer
             self.log_manager.log("Motion detected! Recording...")
 
 
@@ -69,39 +93,25 @@ class MotionDetector(threading.Thread):
 
         self.last_file = self.current_file
         self.current_file = ""
-        self.writer = None
-        self.record = []
+        with self.writer_lock:
+            self.writer = None
 
     def is_recording(self):
-        # return self.writer is not None
-        return len(self.record) > 0 or self.writer is not None
+        return self.writer is not None
 
-    def save(self, data):
+    def save(self):
 
         self.log_manager.log("Saving video...")
         self.saved = False
 
-        if data:
-
-            zero_timestamp = data[0][0]
-
-            writer = cv2.VideoWriter(self.current_file, self.codec, self.frame_rate, (self.width, self.height))
-            total_frames_data = int(math.floor((data[-1][0] - zero_timestamp ) * self.frame_rate))
-            # print ("Frames: {0} | {1}".format(total_frames_data, len(data)))
+        with self.writer_lock:
+            writer, self.writer = self.writer, None
 
-            if total_frames_data < len(data):
-                time_step = 1 / self.frame_rate
-
-                frame_counter = 0
-                timestamp_value = 0
-
-                while timestamp_value <= data[-1][0] - zero_timestamp:
-                    closest_timestamp_, frame_data_ = min(data, key=lambda x: abs((x[0]-zero_timestamp) - timestamp_value))
-                    writer.write(frame_data_)
-                    frame_counter += 1
-                    timestamp_value += time_step
-
-                writer.release()
+        if writer is not None:
+            writer.close()
+            dict_stats = writer.get_stats()
+            self.log_manager.log("Video frames captured: {captured}, written: {written}, duplicated: {duplicated}, "
+                                 "dropped: {dropped}, dropped by the queue: {queue_dropped}".format(**dict_stats))
 
             if self.do_convert:
                 self.convert_to_mp4(self.current_file)
@@ -114,20 +124,11 @@ class MotionDetector(threading.Thread):
             if not self.is_recording():
                 self.start_recording()
 
+            # Frames are written by the grabber thread, see on_frame
             self.saved = False
-            # self.writer.write(self.current_frame)
-            self.record.append((self.current_timestamp, self.current_frame))
 
         elif self.is_recording():
-            if self.writer is not None:
-                self.writer.release()
-
-            self.save(self.record)
-
-            # if self.do_convert:
-            #     self.convert_to_mp4(self.current_file)
-
-            # self.saved = True
+            self.save()
 
             self.stop_recording()
 
@@ -136,26 +137,9 @@ class MotionDetector(threading.Thread):
     def convert_to_mp4(self, file_path=""):
 
         self.log_manager.log("Converting video...")
-        try:
-            mp4_file = "{0}.mp4".format(os.path.splitext(file_path)[0])
-            lst_cmd = []
-            lst_cmd.append("ffmpeg")
-            lst_cmd.append("-i {}".format(file_path))
-            lst_cmd.append("{}".format(mp4_file))
-
-            cmd = " ".join(lst_cmd)
-            p = subprocess.Popen(cmd, shell=True)
-            (output, err) = p.communicate()
-
-            if os.path.exists(file_path):
-                p.wait()
-                os.remove(file_path)
-
-            self.current_file = mp4_file
-
-        except subprocess.CalledProcessError:
-            self.log_manager.log("Error converting video")
-
+        job = self.transcoder.submit_convert(file_path, ".mp4")
+        if job is not None:
+            self.current_file = job.output_file
 
     def get_video_capture(self):
 
@@ -170,60 +154,113 @@ class MotionDetector(threading.Thread):
         return frame.shape[0: 2]
 
     def get_frame(self):
-        if self.current_frame is not None:
-            ret, jpeg = cv2.imencode('.jpg', self.current_frame)
-            return jpeg.tobytes()
-        return None
+        return self.broadcaster.get_jpeg()
+
+    def draw_overlay(self, frame):
+        video_text = "{0} | {1}".format(str(datetime.datetime.now()).split(".")[0], self.video_text)
+        cv2.putText(frame, video_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA)
+
+    def on_frame(self, frame_ref):
+        """
+        Called by the grabber for every published frame: hand it to the viewers and the recording
+        """
+        self.broadcaster.publish(frame_ref.frame, frame_ref.timestamp, frame_ref.is_valid)
+
+        with self.writer_lock:
+            if self.writer is not None:
+                # Queued by the writer, so it cannot stay a view into the ring
+                self.writer.write(frame_ref.timestamp, frame_ref.frame.copy())
+
+    def is_motion(self, motion_percentage=0.0):
+        if not self.analyzer.zones:
+            return motion_percentage > self.threshold
+
+        # Any zone over its own threshold
+        thresholds = [self.threshold if zone_.threshold is None else zone_.threshold for zone_ in self.analyzer.zones]
+        return bool(np.any(self.analyzer.zone_values > thresholds))
+
+    def get_zone_values(self):
+        return {zone_.name: round(float(value_), 2) for zone_, value_ in zip(self.analyzer.zones, self.analyzer.zone_values)}
+
+    def get_stats(self):
+        dict_stats = self.grabber.get_stats()
+        dict_stats.update(self.broadcaster.get_stats())
+        dict_stats.update({
+            "analysed": self.analysed_count,
+            "analysis_dropped": self.analysis_dropped,
+            "analysis_invalid": self.analysis_invalid,
+            "analysis_rate": self.analysis_rate,
+            "zones": self.get_zone_values(),
+        })
+        return dict_stats
+
+    @property
+    def fps(self):
+        return self.grabber.fps
 
     @property
     def value(self):
         return self._value if self._value > 0.0 else 0.0
 
+    @property
+    def detect_motion(self):
+        return self.trigger.active
+
     def run(self):
 
         self.log_manager.log("Observing...")
 
-        deque_observer = deque(maxlen=utils.OBSERVER_LENGTH * self.frame_rate)
-        previous_frame = None
+        self.trigger.reset()
+        self.analyzer.reset()
 
-        while True:
+        if not self.grabber.is_alive():
+            self.grabber.start()
 
-            grabbed, self.current_frame = self.video.read()
-            self.current_timestamp = time.time()
+        sequence = 0
+        interval = 1.0 / self.analysis_rate
+        next_time = time.time()
 
-            if not grabbed:
-                break
+        while True:
 
-            video_text = "{0} | {1}".format(str(datetime.datetime.now()).split(".")[0], self.video_text)
-            cv2.putText(self.current_frame, video_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA)
+            # Analyse at most analysis_rate frames per second, always the newest one
+            wait_time = next_time - time.time()
+            if wait_time > 0:
+                time.sleep(wait_time)
+            next_time = max(next_time + interval, time.time())
 
-            frame_gray = cv2.cvtColor(self.current_frame, cv2.COLOR_BGR2GRAY)
-            frame_blur = cv2.GaussianBlur(frame_gray, (21, 21), 0)
+            frame_ref = self.grabber.wait_for_frame(sequence)
 
-            if previous_frame is None:
-                previous_frame = frame_blur
+            if frame_ref is None:
+                if self.grabber.stopped:
+                    break
                 continue
 
-            delta_frame = cv2.absdiff(previous_frame, frame_blur)
-
-            threshold_frame = cv2.threshold(delta_frame, 15, 255, cv2.THRESH_BINARY)[1]
-
-            kernel = np.ones((5, 5), np.uint8)
-            dilated_frame = cv2.dilate(threshold_frame, kernel, iterations=4)
+            if sequence:
+                self.analysis_dropped += frame_ref.sequence - sequence - 1
+            sequence = frame_ref.sequence
+            self.current_frame, self.current_timestamp = frame_ref.frame, frame_ref.timestamp
+            self.analysed_count += 1
 
-            res = dilated_frame.astype(np.uint8)
-            motion_percentage = (np.count_nonzero(res) * 100) / res.size
-
-            deque_observer.append(motion_percentage)
+            motion_percentage = self.analyzer.process(frame_ref.frame)
+            if not frame_ref.is_valid():
+                # Overwritten by the grabber while it was analysed
+                self.analysis_invalid += 1
+                continue
+            if motion_percentage is None:
+                continue
 
             self._value = motion_percentage
 
-            self.detect_motion = sum([x > self.threshold for x in deque_observer]) > 0
+            self.trigger.update(self.is_motion(motion_percentage))
 
             if self.do_record:
                 self.do_recording()
 
-            previous_frame = frame_blur
+        # End of a file or generated video source
+        if self.is_recording():
+            self.save()
+            self.stop_recording()
+        self.log_manager.log("Video source ended")
 
 def main():
     md = MotionDetector(do_convert=False)
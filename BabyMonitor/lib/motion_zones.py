@@ -0,0 +1,85 @@
+import cv2
+import numpy as np
+
+from BabyMonitor.lib import utils
+
+MAX_ZONES = 8  # One bit of the label mask per zone
+
+
+class MotionZone:
+
+    def __init__(self, name="", points=(), threshold=None):
+        self.name = name
+        self.points = np.array(points, dtype=np.float64).reshape(-1, 2)  # Polygon in full resolution pixels
+        self.threshold = threshold  # Motion percentage of the zone, None for the detector's threshold
+
+        if len(self.points) < 3:
+            raise ValueError("Motion zone '{0}' needs at least 3 points".format(name))
+
+    def to_dict(self):
+        return {"name": self.name, "points": self.points.tolist(), "threshold": self.threshold}
+
+
+def read_zones(file_path=""):
+    """
+    [{"name": "crib", "points": [[x, y], ...], "threshold": 5}, ...]
+    """
+    return [MotionZone(**dict_zone_) for dict_zone_ in utils.read_json(file_path)]
+
+
+def get_bounding_rect(lst_zones, shape):
+    """
+    @return tuple: (x, y, width, height) around all zones, clipped to the frame
+    """
+    points = np.concatenate([zone_.points for zone_ in lst_zones])
+    x0, y0 = np.clip(np.floor(points.min(axis=0)).astype(int), 0, (shape[1] - 1, shape[0] - 1))
+    x1, y1 = np.clip(np.ceil(points.max(axis=0)).astype(int) + 1, 1, (shape[1], shape[0]))
+    return int(x0), int(y0), int(max(1, x1 - x0)), int(max(1, y1 - y0))
+
+
+def get_label_counts(labels):
+    # Same as np.bincount(labels.ravel(), minlength=256), without converting the mask to intp first
+    return cv2.calcHist([labels], [0], None, [1 << MAX_ZONES], [0, 1 << MAX_ZONES]).ravel().astype(np.int64)
+
+
+class ZoneIndex:
+    """
+    Zones rasterized once for one analysis resolution: every pixel holds a bit per zone it belongs to, so
+    overlapping zones are fine. The motion of all zones comes out of a single histogram of the label mask.
+    """
+
+    def __init__(self, lst_zones, offset=(0, 0), scale=(1.0, 1.0), size=(1, 1)):
+        if len(lst_zones) > MAX_ZONES:
+            raise ValueError("At most {0} motion zones are supported".format(MAX_ZONES))
+
+        self.lst_zones = list(lst_zones)
+        width, height = size
+
+        self.labels = np.zeros((height, width), dtype=np.uint8)
+        mask = np.empty_like(self.labels)
+        for i, zone_ in enumerate(self.lst_zones):
+            points = np.round((zone_.points - offset) * scale).astype(np.int32)
+            mask.fill(0)
+            cv2.fillPoly(mask, [points], 1 << i)
+            cv2.bitwise_or(self.labels, mask, dst=self.labels)
+
+        # membership[label, zone] is 1 when the label has the zone's bit set
+        labels = np.arange(1 << MAX_ZONES)
+        self.membership = ((labels[:, None] >> np.arange(len(self.lst_zones))) & 1).astype(np.int64)
+
+        self.label_counts = get_label_counts(self.labels)
+        self.zone_pixels = np.maximum(self.label_counts @ self.membership, 1)
+        self.union_pixels = max(1, int(self.label_counts[1:].sum()))
+
+        self.masked = np.empty_like(self.labels)
+
+    def measure(self, motion_mask):
+        """
+        @param numpy-Array motion_mask: 0 / 255 mask at the analysis resolution
+        @return tuple: (motion percentage of all zones together, numpy-Array of the percentage of every zone)
+        """
+        cv2.bitwise_and(self.labels, motion_mask, dst=self.masked)
+        counts = get_label_counts(self.masked)
+        counts[0] = 0
+
+        return counts.sum() * 100 / self.union_pixels, (counts @ self.membership) * 100 / self.zone_pixels
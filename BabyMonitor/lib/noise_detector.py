@@ -1,18 +1,29 @@
-import pyaudio
-import subprocess
 import os
 import time
 import math
-import struct
 import threading
 import numpy as np
-from collections import deque
 
 from BabyMonitor.lib import utils
+from BabyMonitor.lib import wav_writer
+from BabyMonitor.lib import noise_engines
+from BabyMonitor.lib import noise_floor
+from BabyMonitor.lib import trigger
+from BabyMonitor.lib import ring_buffer
+from BabyMonitor.lib import audio_stream
+from BabyMonitor.lib import transcoder
+
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None  # Only an audio_source can be used
+
+NOISE_STAGES = ("read", "history", "stream", "engine", "floor", "record")
+
 
 class NoiseDetector(threading.Thread):
 
-    def __init__(self, do_record=True, do_convert=True):
+    def __init__(self, do_record=True, do_convert=True, engine="rms", audio_source=None):
         threading.Thread.__init__(self)
 
         self.name = str(self.__class__.__name__)
@@ -20,20 +31,26 @@ class NoiseDetector(threading.Thread):
 
         self.media_dir = os.path.abspath("../media")
 
-        self.FORMAT = pyaudio.paFloat32
+        self.FORMAT = pyaudio.paFloat32 if pyaudio else None
+        self.DTYPE = np.float32  # Sample type of self.FORMAT
         self.RATE = 48000  # Hz, so samples (bytes) per second
         self.CHUNK_SIZE = 2048  # How many bytes to read from mic each time (stream.read())
         self.CHUNKS_PER_SEC = math.floor(self.RATE / self.CHUNK_SIZE)  # How many chunks make a second? (16.000 bytes/s, each chunk is 1.024 bytes, so 1s is 15 chunks)
         self.CHANNELS = 1
         self.HISTORY_LENGTH = 2  # Seconds of audio cache for prepending to records to prevent chopped phrases (history length + observer length = min record length)
+        self.RECORD_BUFFER_LENGTH = 4  # Seconds of audio kept in memory while recording, full segments are spilled to disk (0 writes every chunk directly)
 
-        self.audio = pyaudio.PyAudio()
-        self.stream = self.get_stream()
-        self.threshold = self.determine_threshold()
+        self.engine = noise_engines.get_engine(engine, self.RATE, self.CHUNK_SIZE)
+
+        self.audio = None
+        self.stream = audio_source if audio_source is not None else self.get_stream()
+        self.noise_floor = noise_floor.NoiseFloorTracker(update_rate=self.RATE / self.CHUNK_SIZE)
         self.chunk = None
-        self.detect_noise = False
+        self.samples = None  # View of the current chunk inside self.history
+        self.trigger = trigger.SlidingWindowTrigger(utils.OBSERVER_LENGTH * self.CHUNKS_PER_SEC)
 
-        self.record = []
+        self.writer = None
+        self.external_writer = None  # Writer handed over by the ThreadManager for the next record (piped mode)
         self.do_record = do_record
         self.do_convert = do_convert
         self.force_recording = False
@@ -41,48 +58,47 @@ class NoiseDetector(threading.Thread):
         self.saved = False
 
         self._value = 0.0
+        self.chunk_count = 0
+        self.profile = False
+        self.dict_stage_times = dict.fromkeys(NOISE_STAGES, 0.0)
+        self.last_tick = 0.0
 
         self.current_file = ""
         self.last_file = ""
-        self.deque_history = deque(maxlen=self.HISTORY_LENGTH * self.CHUNKS_PER_SEC)
+        self.history = ring_buffer.AudioRingBuffer(self.HISTORY_LENGTH * self.RATE * self.CHANNELS, self.DTYPE)
+        self.audio_stream = audio_stream.AudioStreamChannel(self.RATE)
+        self.transcoder = transcoder.get_default_queue()
 
     def __del__(self):
         self.stream.close()
-        self.audio.terminate()
+        if self.audio is not None:
+            self.audio.terminate()
 
     def get_stream(self):
+        if pyaudio is None:
+            raise RuntimeError("PyAudio is not installed, pass an audio_source (see capture_sources)")
+        self.audio = pyaudio.PyAudio()
         return self.audio.open(format=self.FORMAT, channels=self.CHANNELS, rate=self.RATE, input=True, frames_per_buffer=self.CHUNK_SIZE)
 
-    def determine_threshold(self):
-
-        self.log_manager.log("Determining threshold...")
-
-        lst_res = []
-        for x in range(50):
-            block = self.stream.read(self.CHUNK_SIZE, exception_on_overflow=False)
-            rms = self.get_rms(block)
-            lst_res.append(rms)
-
-        threshold = (sum(lst_res) / len(lst_res)) * 1.2
-
-        self.log_manager.log("Setting threshold to: {0}".format(threshold))
-
-        return threshold
+    @property
+    def threshold(self):
+        return self.noise_floor.threshold
 
-    def get_rms(self, block):
-        """
-        Calculate Root Mean Square (noise level) for audio chunk
+    def get_threshold_history(self):
+        return self.noise_floor.get_history()
 
-        @param bytes block
-        @return float
-        """
-        d = np.frombuffer(block, np.float32).astype(np.float)
-        return np.sqrt((d * d).sum() / len(d))
+    @property
+    def band_scores(self):
+        return self.engine.band_scores
 
     @property
     def value(self):
         return self._value if self._value > self.threshold else 0.0
 
+    @property
+    def detect_noise(self):
+        return self.trigger.active
+
     def start_recording(self):
 
         if not (self.use_other_to_record and self.current_file):
@@ -94,45 +110,103 @@ class NoiseDetector(threading.Thread):
             if not os.path.exists(dst_dir):
                 os.makedirs(dst_dir)
 
+            self.saved = False
+            if self.external_writer is not None:
+                self.writer, self.external_writer = self.external_writer, None
+            elif self.RECORD_BUFFER_LENGTH > 0:
+                self.writer = wav_writer.BufferedWavWriter(self.current_file, self.RATE, self.CHANNELS, self.DTYPE,
+                                                           buffer_length=self.RECORD_BUFFER_LENGTH)
+            else:
+                self.writer = wav_writer.WavWriter(self.current_file, self.RATE, self.CHANNELS, self.DTYPE)
+
+            self.write_preroll()
+
             self.log_manager.log("Noise detected! Recording...")
 
+    def get_preroll_length(self):
+        """
+        Seconds of history prepended to every record, the same for every record so the video can be aligned to it
+        """
+        return (self.history.capacity - self.CHUNK_SIZE * self.CHANNELS) / (self.RATE * self.CHANNELS)
+
+    def write_preroll(self):
+
+        # Prepend the history (all but the current chunk), so the record starts before the sound did
+        count = self.history.capacity - self.CHUNK_SIZE * self.CHANNELS
+        samples = self.history.get_latest(count, skip=self.CHUNK_SIZE * self.CHANNELS)
+        if len(samples) < count:
+            self.writer.write(np.zeros(count - len(samples), dtype=self.DTYPE))
+        self.writer.write(samples)
+
     def stop_recording(self):
 
         self.last_file = self.current_file
 
-        self.record = []
+        self.writer = None
         self.current_file = ""
 
     def is_recording(self):
-        return len(self.record) > 0
+        return self.writer is not None
 
     def get_chunk(self):
         return self.chunk
 
+    def tick(self, stage=""):
+        if self.profile:
+            now = time.perf_counter()
+            self.dict_stage_times[stage] += now - self.last_tick
+            self.last_tick = now
+
+    def get_stage_times(self):
+        """
+        @return dict: average milliseconds per chunk for every stage
+        """
+        count = max(1, self.chunk_count)
+        return {stage: total * 1000 / count for stage, total in self.dict_stage_times.items()}
+
     def run(self):
 
-        deque_observer = deque(maxlen=utils.OBSERVER_LENGTH * self.CHUNKS_PER_SEC)
-        self.deque_history = deque(maxlen=self.HISTORY_LENGTH * self.CHUNKS_PER_SEC)
+        self.trigger.reset()
+        self.history.clear()
 
-        self.log_manager.log("Listening...")
+        self.log_manager.log("Listening, calibrating noise floor...")
 
         try:
             while True:
+                self.last_tick = time.perf_counter() if self.profile else 0.0
+
                 self.chunk = self.stream.read(self.CHUNK_SIZE, exception_on_overflow=False)
-                self.deque_history.append(self.chunk)
+                self.tick("read")
+                self.samples = self.history.write(self.chunk)
+                self.tick("history")
+                self.audio_stream.publish(self.samples)
+                self.tick("stream")
+
+                level = self.engine.process(self.samples)
+                self._value = level
+                self.tick("engine")
 
-                rms = self.get_rms(self.chunk)
-                deque_observer.append(rms)
+                calibrated = self.noise_floor.ready
+                self.noise_floor.update(level)
+                if not calibrated and self.noise_floor.ready:
+                    self.log_manager.log("Setting threshold to: {0}".format(self.threshold))
 
-                self._value = rms
+                self.trigger.update(level > self.threshold)
+                self.tick("floor")
 
-                self.detect_noise = sum([x > self.threshold for x in deque_observer]) > 0
                 if self.do_record:
                     self.do_recording()
+                self.tick("record")
 
-                pass
+                self.chunk_count += 1
         except KeyboardInterrupt:
             self.log_manager.log("Interrupted!")
+        except EOFError:
+            # End of a file or generated audio source
+            if self.is_recording():
+                self.save()
+                self.stop_recording()
+            self.log_manager.log("Audio source ended")
 
     def do_recording(self):
 
@@ -141,25 +215,24 @@ class NoiseDetector(threading.Thread):
 
                 self.start_recording()
 
-            self.record.append(self.chunk)
+            if self.writer is not None:
+                self.writer.write(self.samples)
 
         elif self.is_recording():
-            # self.save(list(self.deque_history) + self.record)
-            self.save(self.record)
+            self.save()
 
             self.log_manager.log("Listening...")
 
             self.stop_recording()
 
-    def save(self, data):
+    def save(self):
 
         self.log_manager.log("Saving audio...")
         self.saved = False
         if self.current_file:
-            data = b''.join(data)
-
-            with open(self.current_file, "wb+") as f:
-                f.write(self.generate_wav(data))
+            self.writer.close()
+            if getattr(self.writer, "overruns", 0):
+                self.log_manager.log("Audio buffer overruns while saving: {0}".format(self.writer.overruns))
 
             if self.do_convert:
                 self.convert_to_mp3(self.current_file)
@@ -169,27 +242,9 @@ class NoiseDetector(threading.Thread):
     def convert_to_mp3(self, file_path=""):
 
         self.log_manager.log("Converting audio...")
-
-        try:
-            mp3_file = "{0}.mp3".format(os.path.splitext(file_path)[0])
-
-            lst_cmd = []
-            lst_cmd.append("ffmpeg")
-            lst_cmd.append("-i {}".format(file_path))
-            lst_cmd.append("-f mp3")
-            lst_cmd.append("{}".format(mp3_file))
-
-            p = subprocess.Popen(" ".join(lst_cmd), shell=True)
-            (output, err) = p.communicate()
-
-            if os.path.exists(file_path):
-                p.wait()
-                os.remove(file_path)
-
-            self.current_file = mp3_file
-
-        except subprocess.CalledProcessError:
-            self.log_manager.log("Error converting audio")
+        job = self.transcoder.submit_convert(file_path, ".mp3", ["-f", "mp3"])
+        if job is not None:
+            self.current_file = job.output_file
 
     def bytes_to_array(self, bytes, type):
         """
@@ -200,71 +255,6 @@ class NoiseDetector(threading.Thread):
         """
         return np.frombuffer(bytes, dtype=type)
 
-    def generate_wav(self, raw):
-        """
-        Create WAVE-file from raw audio chunks
-
-        @param bytes raw
-        @return bytes
-        """
-        # Check if input format is supported
-        if self.FORMAT not in (pyaudio.paFloat32, pyaudio.paInt16):
-            print("Unsupported format")
-            return
-
-        # Convert raw audio bytes to typed array
-        samples = self.bytes_to_array(raw, np.float32)
-
-        # Get sample size
-        sample_size = pyaudio.get_sample_size(self.FORMAT)
-
-        # Get data-length
-        byte_count = (len(samples)) * sample_size
-
-        # Get bits/sample
-        bits_per_sample = sample_size * 8
-
-        # Calculate frame-size
-        frame_size = int(self.CHANNELS * ((bits_per_sample + 7) / 8))
-
-        # Container for WAVE-content
-        wav = bytearray()
-
-        # Start RIFF-Header
-        wav.extend(struct.pack('<cccc', b'R', b'I', b'F', b'F'))
-        # Add chunk size (data-size minus 8)
-        wav.extend(struct.pack('<I', byte_count + 0x2c - 8))
-        # Add RIFF-type ("WAVE")
-        wav.extend(struct.pack('<cccc', b'W', b'A', b'V', b'E'))
-
-        # Start "Format"-part
-        wav.extend(struct.pack('<cccc', b'f', b'm', b't', b' '))
-        # Add header length (16 bytes)
-        wav.extend(struct.pack('<I', 0x10))
-        # Add format-tag (e.g. 1 = PCM, 3 = FLOAT)
-        wav.extend(struct.pack('<H', 3))
-        # Add channel count
-        wav.extend(struct.pack('<H', self.CHANNELS))
-        # Add sample rate
-        wav.extend(struct.pack('<I', self.RATE))
-        # Add bytes/second
-        wav.extend(struct.pack('<I', self.RATE * frame_size))
-        # Add frame size
-        wav.extend(struct.pack('<H', frame_size))
-        # Add bits/sample
-        wav.extend(struct.pack('<H', bits_per_sample))
-
-        # Start data-part
-        wav.extend(struct.pack('<cccc', b'd', b'a', b't', b'a'))
-        # Add data-length
-        wav.extend(struct.pack('<I', byte_count))
-
-        # Add data
-        for sample in samples:
-            wav.extend(struct.pack("<f", sample))
-
-        return bytes(wav)
-
 
 def main():
 
@@ -0,0 +1,111 @@
+import numpy as np
+
+
+def get_rms(samples):
+    """
+    Root Mean Square (noise level) of a chunk
+
+    @param numpy-Array samples
+    @return float
+    """
+    samples = samples.astype(np.float64, copy=False)
+    return float(np.sqrt(np.dot(samples, samples) / len(samples)))
+
+
+class RmsEngine:
+    """
+    Root Mean Square (noise level) of the whole chunk
+    """
+
+    name = "rms"
+
+    def __init__(self, rate=48000, chunk_size=2048):
+        self.rate = rate
+        self.chunk_size = chunk_size
+        self.band_scores = {}
+
+    def process(self, samples):
+        """
+        @param numpy-Array samples
+        @return float
+        """
+        return get_rms(samples)
+
+
+class CryBandEngine:
+    """
+    Windowed FFT of every chunk, the level is the RMS of the cry band (300 - 3000 Hz) weighted by how tonal it is.
+    Broadband noise (fans, white-noise machines, traffic) is flat and low-pitched, so it scores low.
+    """
+
+    name = "cry_band"
+
+    CRY_BAND = (300, 3000)  # Hz
+
+    def __init__(self, rate=48000, chunk_size=2048):
+        self.rate = rate
+        self.chunk_size = chunk_size
+
+        self.window = np.hanning(chunk_size).astype(np.float32)
+        self.frequencies = np.fft.rfftfreq(chunk_size, 1.0 / rate)
+
+        # Preallocated work buffers
+        self.windowed = np.empty(chunk_size, dtype=np.float32)
+        self.power = np.empty(len(self.frequencies), dtype=np.float64)
+
+        # Band edges as bin indexes: [0, low) below, [low, high) cry band, [high, end) above
+        self.low_bin, self.high_bin = np.searchsorted(self.frequencies, self.CRY_BAND)
+        self.band_edges = np.array([0, self.low_bin, self.high_bin])
+        self.band_energies = np.zeros(len(self.band_edges), dtype=np.float64)
+        self.cry_frequencies = self.frequencies[self.low_bin:self.high_bin]
+
+        # Parseval scaling of the windowed one-sided spectrum back to mean square amplitude
+        self.scale = 2.0 / (chunk_size * np.dot(self.window, self.window))
+
+        self.band_scores = {"low": 0.0, "cry": 0.0, "high": 0.0, "tonality": 0.0, "centroid": 0.0, "score": 0.0}
+
+    def process(self, samples):
+        """
+        @param numpy-Array samples
+        @return float
+        """
+        if len(samples) != self.chunk_size:
+            return get_rms(samples)
+
+        np.multiply(samples, self.window, out=self.windowed)
+        spectrum = np.fft.rfft(self.windowed)
+        np.abs(spectrum, out=self.power)
+        np.square(self.power, out=self.power)
+
+        np.add.reduceat(self.power, self.band_edges, out=self.band_energies)
+        total_energy = self.band_energies.sum()
+        if total_energy <= 0.0:
+            self.band_scores.update(low=0.0, cry=0.0, high=0.0, tonality=0.0, centroid=0.0, score=0.0)
+            return 0.0
+
+        cry_power = self.power[self.low_bin:self.high_bin]
+        cry_energy = self.band_energies[1]
+
+        # Spectral flatness: geometric / arithmetic mean, 1.0 for white noise and close to 0.0 for a harmonic cry
+        flatness = np.exp(np.mean(np.log(cry_power + 1e-20))) / (cry_energy / len(cry_power) + 1e-20)
+        tonality = 1.0 - min(1.0, flatness)
+        centroid = np.dot(self.cry_frequencies, cry_power) / (cry_energy + 1e-20)
+
+        cry_ratio = cry_energy / total_energy
+        self.band_scores.update(low=float(self.band_energies[0] / total_energy),
+                                cry=float(cry_ratio),
+                                high=float(self.band_energies[2] / total_energy),
+                                tonality=float(tonality),
+                                centroid=float(centroid),
+                                score=float(cry_ratio * tonality))
+
+        return float(np.sqrt(cry_energy * self.scale) * tonality)
+
+
+DICT_ENGINES = {engine_.name: engine_ for engine_ in (RmsEngine, CryBandEngine)}
+
+
+def get_engine(name="rms", rate=48000, chunk_size=2048):
+    if name not in DICT_ENGINES:
+        raise ValueError("Unknown noise engine '{0}', expected one of: {1}".format(name, ", ".join(DICT_ENGINES)))
+    return DICT_ENGINES[name](rate, chunk_size)
@@ -0,0 +1,68 @@
+import math
+import time
+from collections import deque
+
+
+class NoiseFloorTracker:
+    """
+    Continuously updated noise-floor estimate, O(1) per level
+
+    Quiet levels move the floor with an exponential average of `time_constant` seconds, levels above the
+    threshold (an event) only with `event_time_constant`, so a cry does not lift the floor while a lasting
+    change of the room (HVAC, an open window) is absorbed after a while. The published threshold only moves
+    when the floor drifted by more than `hysteresis` from it.
+    """
+
+    def __init__(self, update_rate=23, ratio=1.2, time_constant=30.0, event_time_constant=180.0,
+                 hysteresis=0.1, warm_up=50, history_length=3600):
+
+        self.update_rate = update_rate  # Levels per second
+        self.ratio = ratio
+        self.hysteresis = hysteresis
+        self.warm_up = warm_up  # Levels averaged before the threshold is published
+
+        self.alpha = self.get_alpha(time_constant)
+        self.event_alpha = self.get_alpha(event_time_constant)
+
+        self.floor = 0.0
+        self.count = 0
+        self._threshold = math.inf
+
+        self.deque_history = deque(maxlen=history_length)  # (timestamp, threshold) on every change
+
+    def get_alpha(self, time_constant=1.0):
+        return 1.0 - math.exp(-1.0 / max(1e-6, time_constant * self.update_rate))
+
+    @property
+    def ready(self):
+        return self.count >= self.warm_up
+
+    @property
+    def threshold(self):
+        return self._threshold
+
+    def get_history(self):
+        return list(self.deque_history)
+
+    def update(self, level=0.0):
+
+        if not self.ready:
+            # Plain running mean while warming up
+            self.count += 1
+            self.floor += (level - self.floor) / self.count
+            if self.ready:
+                self.set_threshold(self.floor * self.ratio)
+            return self._threshold
+
+        alpha = self.alpha if level <= self._threshold else self.event_alpha
+        self.floor += (level - self.floor) * alpha
+
+        candidate = self.floor * self.ratio
+        if abs(candidate - self._threshold) > self._threshold * self.hysteresis:
+            self.set_threshold(candidate)
+
+        return self._threshold
+
+    def set_threshold(self, threshold=0.0):
+        self._threshold = threshold
+        self.deque_history.append((time.time(), threshold))
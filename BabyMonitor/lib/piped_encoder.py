@@ -0,0 +1,221 @@
+import os
+import queue
+import subprocess
+import threading
+import time
+from collections import deque
+import numpy as np
+
+from BabyMonitor.lib import utils
+from BabyMonitor.lib import frame_resampler
+from BabyMonitor.lib import transcoder
+
+
+class PipeInput:
+    """
+    Bounded queue of buffers written into a pipe by a feeder thread, so the caller never waits on the encoder
+
+    With `fill_dropped`, a buffer dropped because the queue was full is written as as many zero bytes, at its
+    place in the stream: raw PCM has no timestamps, a gap would shift all the later samples.
+    """
+
+    def __init__(self, fd=-1, name="", queue_size=64, fill_dropped=False):
+        self.file = os.fdopen(fd, "wb")
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0  # Buffers dropped because the queue was full
+        self.broken = False
+        self.closed_at = 0.0
+
+        self.fill_dropped = fill_dropped
+        self.queued = 0  # Buffers queued
+        self.lock = threading.Lock()
+        self.deque_gaps = deque()  # [buffers queued before the gap, bytes dropped]
+
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def put(self, data):
+        try:
+            self.queue.put_nowait(data)
+            self.queued += 1
+        except queue.Full:
+            self.dropped += 1
+            if self.fill_dropped:
+                with self.lock:
+                    if self.deque_gaps and self.deque_gaps[-1][0] == self.queued:
+                        self.deque_gaps[-1][1] += memoryview(data).nbytes
+                    else:
+                        self.deque_gaps.append([self.queued, memoryview(data).nbytes])
+
+    def close(self):
+        self.closed_at = time.time()
+        self.queue.put(None)
+
+    def get_gap(self, written=0):
+        """
+        @return int: bytes dropped right after the first `written` buffers
+        """
+        with self.lock:
+            if self.deque_gaps and self.deque_gaps[0][0] == written:
+                return self.deque_gaps.popleft()[1]
+        return 0
+
+    def run(self):
+        written = 0
+        while True:
+            # A gap is recorded while the queue is full, always before the feeder got to its place
+            gap = self.get_gap(written)
+            data = self.queue.get() if not gap else bytes(gap)
+            if data is None:
+                break
+            written += not gap
+            if self.broken:
+                continue
+
+            try:
+                self.file.write(data)
+            except (BrokenPipeError, ValueError):
+                self.broken = True
+
+        try:
+            self.file.close()
+        except BrokenPipeError:
+            pass
+
+
+class VideoInput:
+    """
+    Same interface as video_writer.BackgroundVideoWriter, resampled raw frames go to the encoder
+    """
+
+    def __init__(self, pipe_input, frame_rate=15):
+        self.pipe_input = pipe_input
+        self.resampler = frame_resampler.FrameResampler(frame_rate)
+
+    @property
+    def dropped(self):
+        return self.pipe_input.dropped
+
+    def write(self, timestamp, frame):
+        for frame_ in self.resampler.push(timestamp, frame):
+            self.pipe_input.put(frame_)
+
+    def close(self):
+        for frame_ in self.resampler.flush():
+            self.pipe_input.put(frame_)
+        self.pipe_input.close()
+
+    def get_stats(self):
+        dict_stats = self.resampler.get_stats()
+        dict_stats["queue_dropped"] = self.pipe_input.dropped
+        return dict_stats
+
+
+class AudioInput:
+    """
+    Same interface as wav_writer.WavWriter, raw samples go to the encoder
+    """
+
+    def __init__(self, pipe_input, dtype=np.float32):
+        self.pipe_input = pipe_input
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+
+    @property
+    def overruns(self):
+        return self.pipe_input.dropped
+
+    def write(self, data):
+        # Copy, the samples usually are a view into the history ring
+        self.pipe_input.put(np.array(data, dtype=self.dtype, copy=True).data)
+
+    def close(self):
+        self.pipe_input.close()
+
+
+class PipedRecordingEncoder:
+    """
+    One ffmpeg process per event: raw frames and PCM samples are piped in while recording, and the muxed
+    file is ready as soon as both inputs are closed. No intermediate AVI/WAV files are written.
+
+    `audio_offset` is how many seconds of audio (pre-roll) precede the first video frame. `on_done(output_file,
+    ended)` is called once the file is complete, with the timestamp the recording ended.
+    """
+
+    def __init__(self, output_file="", frame_rate=15, size=(640, 480), audio_rate=48000, channels=1,
+                 audio_dtype=np.float32, audio_offset=0.0, preset="ultrafast", nice=5, on_done=None):
+
+        self.name = str(self.__class__.__name__)
+        self.log_manager = utils.LogManager(self.name)
+
+        self.output_file = output_file
+        self.temp_file = transcoder.get_temp_file(output_file)
+        self.on_done = on_done
+        self.returncode = None
+        self.started = time.time()
+        self.finished = 0.0
+
+        dst_dir = os.path.dirname(output_file)
+        if dst_dir and not os.path.exists(dst_dir):
+            os.makedirs(dst_dir)
+
+        video_read, video_write = os.pipe()
+        audio_read, audio_write = os.pipe()
+
+        audio_format = {np.dtype('<f4'): "f32le", np.dtype('<i2'): "s16le"}[np.dtype(audio_dtype).newbyteorder('<')]
+
+        lst_cmd = ["ffmpeg", "-nostdin", "-y", "-loglevel", "error",
+                   "-itsoffset", "{0:.3f}".format(audio_offset),
+                   "-f", "rawvideo", "-pix_fmt", "bgr24", "-video_size", "{0}x{1}".format(*size),
+                   "-framerate", str(frame_rate), "-i", "pipe:{0}".format(video_read),
+                   "-f", audio_format, "-ar", str(audio_rate), "-ac", str(channels), "-i", "pipe:{0}".format(audio_read),
+                   "-c:v", "libx264", "-preset", preset, "-crf", "23", "-pix_fmt", "yuv420p",
+                   "-c:a", "aac", "-b:a", "96k"] + transcoder.FASTSTART_ARGS + [self.temp_file]
+
+        try:
+            self.process = subprocess.Popen(lst_cmd, pass_fds=(video_read, audio_read))
+        except OSError:
+            os.close(video_write)
+            os.close(audio_write)
+            raise
+        finally:
+            os.close(video_read)
+            os.close(audio_read)
+
+        if nice:
+            transcoder.lower_priority(self.process.pid, nice)
+
+        self.video_input = VideoInput(PipeInput(video_write, "{0}-video".format(self.name)), frame_rate)
+        self.audio_input = AudioInput(PipeInput(audio_write, "{0}-audio".format(self.name), fill_dropped=True), audio_dtype)
+
+        self.log_manager.log("Encoding {0}...".format(os.path.basename(output_file)))
+
+        self.thread = threading.Thread(target=self.run, name="{0}-wait".format(self.name), daemon=True)
+        self.thread.start()
+
+    @property
+    def done(self):
+        return self.returncode is not None
+
+    def close(self):
+        self.video_input.close()
+        self.audio_input.close()
+
+    def run(self):
+        self.video_input.pipe_input.thread.join()
+        self.audio_input.pipe_input.thread.join()
+        self.returncode = self.process.wait()
+        self.finished = time.time()
+
+        if self.returncode == 0 and os.path.exists(self.temp_file):
+            os.replace(self.temp_file, self.output_file)
+            self.log_manager.log("Done {0}, available {1:.1f} s after the event ended".format(
+                os.path.basename(self.output_file), self.finished - self.get_closed_time()))
+            if self.on_done is not None:
+                self.on_done(self.output_file, self.get_closed_time())
+        else:
+            if os.path.exists(self.temp_file):
+                os.remove(self.temp_file)
+            self.log_manager.log("Error encoding {0} (exit code {1})".format(os.path.basename(self.output_file), self.returncode))
+
+    def get_closed_time(self):
+        return max(self.video_input.pipe_input.closed_at, self.audio_input.pipe_input.closed_at)
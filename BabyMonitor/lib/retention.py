@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+
+from BabyMonitor.lib import utils
+
+DAY = 86400
+
+
+def get_free_space(path=""):
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+class MediaIndex:
+    """
+    Size and modification time of the archive files of a directory (hidden files are recordings in progress
+    or being converted, never part of the archive)
+
+    refresh() only lists the directory again when its modification time changed, i.e. a file was added,
+    renamed or removed, and only stats the new names.
+    """
+
+    def __init__(self, media_dir=""):
+        self.media_dir = media_dir
+        self.dict_files = {}  # name -> (mtime, size)
+        self.total_size = 0
+        self.dir_mtime = None
+
+    def refresh(self):
+        try:
+            dir_mtime = os.stat(self.media_dir).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if dir_mtime == self.dir_mtime:
+            return False
+        self.dir_mtime = dir_mtime
+
+        set_names = set(name_ for name_ in os.listdir(self.media_dir) if not name_.startswith("."))
+        for name_ in set(self.dict_files) - set_names:
+            self.total_size -= self.dict_files.pop(name_)[1]
+
+        for name_ in set_names - set(self.dict_files):
+            try:
+                stat = os.stat(os.path.join(self.media_dir, name_))
+            except FileNotFoundError:
+                continue
+            self.dict_files[name_] = (stat.st_mtime, stat.st_size)
+            self.total_size += stat.st_size
+        return True
+
+    def get_oldest(self):
+        """
+        @return list: (name, mtime, size) of the files, oldest first
+        """
+        return sorted(((name_, mtime_, size_) for name_, (mtime_, size_) in self.dict_files.items()), key=lambda item_: item_[1])
+
+    def remove(self, name=""):
+        os.remove(os.path.join(self.media_dir, name))
+        self.total_size -= self.dict_files.pop(name)[1]
+        self.dir_mtime = os.stat(self.media_dir).st_mtime_ns  # Our own change, no rescan needed
+
+
+class RetentionManager(threading.Thread):
+    """
+    Keeps the archive within its budgets: files older than `max_age` days, then the oldest files while the
+    archive is over `max_size` bytes or the disk has less than `min_free` bytes left, are deleted.
+    `prune_database()` is called every run as well and returns the number of rows it deleted. `on_delete(name)`
+    is called for every file deleted, `on_change(index)` after the deletions when others added or removed files
+    since the last run.
+
+    Runs every `interval` seconds at the lowest CPU priority, deleting at most `batch_size` files per run.
+    """
+
+    def __init__(self, media_dir="", max_age=30, max_size=0, min_free=500 * 2 ** 20, prune_database=None,
+                 interval=60.0, batch_size=50, nice=19, on_delete=None, on_change=None):
+        threading.Thread.__init__(self, daemon=True)
+
+        self.name = str(self.__class__.__name__)
+        self.log_manager = utils.LogManager(self.name)
+
+        self.index = MediaIndex(media_dir)
+        self.max_age = max_age  # Days, 0: no limit
+        self.max_size = max_size  # Bytes, 0: no limit
+        self.min_free = min_free
+        self.prune_database = prune_database
+        self.on_delete = on_delete
+        self.on_change = on_change
+        self.interval = interval
+        self.batch_size = batch_size
+        self.nice = nice
+
+        self.lock = threading.Lock()
+        self.free_space = 0
+        self.deleted_files = 0
+        self.deleted_bytes = 0
+        self.pruned_rows = 0
+        self.last_run = 0.0
+        self.last_duration = 0.0
+
+    def run(self):
+        if self.nice:
+            # Linux priorities are per thread, this leaves the capture and web server threads alone
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.nice)
+
+        while True:
+            try:
+                self.enforce()
+            except Exception as e:
+                self.log_manager.log("Error enforcing retention: {0}".format(e))
+            time.sleep(self.interval)
+
+    def is_over_budget(self):
+        return (self.max_size and self.index.total_size > self.max_size) or self.free_space < self.min_free
+
+    def enforce(self):
+        start = time.time()
+        changed = self.index.refresh()
+        self.free_space = get_free_space(self.index.media_dir) if os.path.isdir(self.index.media_dir) else 0
+
+        deleted = 0
+        for name_, mtime_, size_ in self.index.get_oldest():
+            if deleted >= self.batch_size:
+                break
+
+            if self.max_age and mtime_ < start - self.max_age * DAY:
+                reason = "older than {0} days".format(self.max_age)
+            elif self.is_over_budget():
+                reason = "over budget"
+            else:
+                break
+
+            try:
+                self.index.remove(name_)
+            except OSError as e:
+                self.log_manager.log("Error deleting {0}: {1}".format(name_, e))
+                continue
+
+            self.free_space += size_
+            deleted += 1
+            with self.lock:
+                self.deleted_files += 1
+                self.deleted_bytes += size_
+            self.log_manager.log("Deleted {0} ({1})".format(name_, reason))
+            if self.on_delete is not None:
+                self.on_delete(name_)
+
+        if self.is_over_budget() and deleted < self.batch_size:
+            self.log_manager.log("Disk space low: {0:.0f} MB free, nothing left to delete".format(self.free_space / 2 ** 20))
+
+        if changed and self.on_change is not None:
+            try:
+                self.on_change(self.index)
+            except Exception as e:
+                self.index.dir_mtime = None  # Listed again, and on_change called again, next run
+                self.log_manager.log("Error handling the changed files: {0}".format(e))
+
+        if self.prune_database is not None:
+            pruned = self.prune_database()
+            with self.lock:
+                self.pruned_rows += pruned
+
+        self.last_run = start
+        self.last_duration = time.time() - start
+        return deleted
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "files": len(self.index.dict_files),
+                "total_size": self.index.total_size,
+                "free_space": self.free_space,
+                "max_age": self.max_age,
+                "max_size": self.max_size,
+                "min_free": self.min_free,
+                "deleted_files": self.deleted_files,
+                "deleted_bytes": self.deleted_bytes,
+                "pruned_rows": self.pruned_rows,
+                "last_run": self.last_run,
+                "last_duration": round(self.last_duration, 3),
+            }
@@ -0,0 +1,72 @@
+import numpy as np
+
+
+class AudioRingBuffer:
+    """
+    Preallocated ring of samples for the last `capacity` samples
+
+    The ring is stored twice back to back (mirrored), so the last N samples are always one contiguous
+    slice and can be handed out as a view without copying. Views stay valid until the ring wraps over them.
+    """
+
+    def __init__(self, capacity=96000, dtype=np.float32):
+        self.capacity = max(1, int(capacity))
+        self.dtype = np.dtype(dtype)
+        self.buffer = np.zeros(self.capacity * 2, dtype=self.dtype)
+
+        self.position = 0  # Next write index in [0, capacity)
+        self.size = 0  # Valid samples in the ring
+        self.total = 0  # Samples written since creation
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        self.position = 0
+        self.size = 0
+
+    def write(self, data):
+        """
+        Copy a chunk (bytes or array) into the ring
+
+        @param bytes|numpy-Array data
+        @return numpy-Array: view of the written samples inside the ring
+        """
+        samples = np.frombuffer(data, dtype=self.dtype) if not isinstance(data, np.ndarray) else data
+        count = len(samples)
+        if count > self.capacity:
+            samples = samples[-self.capacity:]
+            self.total += count - self.capacity
+            count = self.capacity
+
+        first = min(count, self.capacity - self.position)
+        rest = count - first
+
+        self.buffer[self.position:self.position + first] = samples[:first]
+        self.buffer[self.position + self.capacity:self.position + self.capacity + first] = samples[:first]
+        if rest:
+            self.buffer[:rest] = samples[first:]
+            self.buffer[self.capacity:self.capacity + rest] = samples[first:]
+
+        self.position = (self.position + count) % self.capacity
+        self.size = min(self.capacity, self.size + count)
+        self.total += count
+
+        return self.get_latest(count)
+
+    def get_latest(self, count=0, skip=0):
+        """
+        Contiguous view of the newest `count` samples, leaving out the newest `skip`
+
+        @param int count: 0 for everything available
+        @return numpy-Array
+        """
+        skip = min(skip, self.size)
+        available = self.size - skip
+        count = available if count <= 0 else min(count, available)
+
+        end = self.position + self.capacity - skip
+        return self.buffer[end - count:end]
+
+    def get_latest_seconds(self, seconds=1.0, rate=48000, skip=0):
+        return self.get_latest(int(seconds * rate), skip)
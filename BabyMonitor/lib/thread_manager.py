@@ -1,17 +1,20 @@
 import threading
 import os
-import subprocess
 import time
 
 from BabyMonitor.lib import motion_detector
 from BabyMonitor.lib import noise_detector
 from BabyMonitor.lib import dht_detector
 from BabyMonitor.lib import utils
+from BabyMonitor.lib import transcoder
+from BabyMonitor.lib import piped_encoder
+from BabyMonitor.lib import motion_zones
+from BabyMonitor.lib import detector_process
 
 
 class ThreadManager(threading.Thread):
 
-    def __init__(self):
+    def __init__(self, noise_engine="", motion_engine="", video_source=None, audio_source=None):
 
         threading.Thread.__init__(self)
 
@@ -19,15 +22,34 @@ class ThreadManager(threading.Thread):
         self.do_record = False
         self.record_state = False
         self.is_merged = False
+        self.merged_files = ("", "")  # Last (video, audio) merged
 
         self.log_manager = utils.LogManager(self.name)
         self.media_dir = os.path.abspath("../media")
-
-        self.motion_detector = motion_detector.MotionDetector(do_convert=False, do_record=self.do_record)
+        self.transcoder = transcoder.get_default_queue()
+        self.transcoder.add_listener(self.on_record_done)
+        self.record_mode = os.environ.get("RECORD_MODE", "files")  # "files": AVI + WAV merged afterwards, "piped": encoded while recording
+        self.encoder = None
+
+        self.motion_engine = motion_engine or os.environ.get("MOTION_ENGINE", "frame_diff")
+        self.motion_zones = motion_zones.read_zones(os.environ["MOTION_ZONES"]) if os.environ.get("MOTION_ZONES") else []
+        self.detector_mode = os.environ.get("DETECTOR_MODE", "threads")  # "processes": every detector in its own process
+
+        if self.detector_mode == "processes" and self.record_mode == "piped":
+            self.log_manager.log("Piped recording needs the detectors in this process, recording files instead")
+            self.record_mode = "files"
+
+        motion_detector_class = detector_process.MotionDetectorProxy if self.detector_mode == "processes" else motion_detector.MotionDetector
+        self.motion_detector = motion_detector_class(video_capture_source=video_source, do_convert=False, do_record=self.do_record,
+                                                     engine=self.motion_engine, zones=self.motion_zones)
         self.motion_detector.use_other_to_record = True
         # self.motion_detector.start()
 
-        self.noise_detector = noise_detector.NoiseDetector(do_convert=False, do_record=self.do_record)
+        self.noise_engine = noise_engine or os.environ.get("NOISE_ENGINE", "rms")
+
+        noise_detector_class = detector_process.NoiseDetectorProxy if self.detector_mode == "processes" else noise_detector.NoiseDetector
+        self.noise_detector = noise_detector_class(do_convert=False, do_record=self.do_record, engine=self.noise_engine,
+                                                   audio_source=audio_source)
         self.noise_detector.use_other_to_record = True
         # self.noise_detector.start()
 
@@ -37,9 +59,9 @@ class ThreadManager(threading.Thread):
         self.fill_do_record()
 
     def __del__(self):
-        self.motion_detector.join()
-        self.noise_detector.join()
-        self.dht_detector.join()
+        for thread_ in (self.motion_detector, self.noise_detector, self.dht_detector):
+            if thread_.ident is not None:
+                thread_.join()
 
     def fill_do_record(self):
         self.motion_detector.do_record = self.do_record
@@ -52,53 +74,98 @@ class ThreadManager(threading.Thread):
     def get_record_path_name(self):
         return os.path.join(self.media_dir, utils.get_timestamp())
 
-    def merge_video_and_audio(self, video_file="", audio_file="", output_file=""):
+    def merge_video_and_audio(self, video_file="", audio_file="", output_file="", audio_offset=0.0):
         # ffmpeg -i video.mp4 -i audio.wav -c:v copy -c:a aac output.mp4
         # ffmpeg -i input.avi -c:v libx264 -crf 19 -preset slow -c:a aac -b:a 192k -ac 2 out.mp4
 
-        try:
-            if video_file and audio_file and output_file:
-                self.log_manager.log("Merging audio and video files...")
-
-                lst_cmd = []
-                lst_cmd.append("ffmpeg")
-                lst_cmd.append("-i {0}".format(video_file))
-                lst_cmd.append("-i {0}".format(audio_file))
-                # lst_cmd.append("-c:v copy")
-
-                # H.264 codec
-                lst_cmd.append("-c:v libx264")
-                lst_cmd.append("-crf 19")
-                lst_cmd.append("-preset slow")
+        if video_file and audio_file:
+            self.log_manager.log("Merging audio and video files...")
+            return self.transcoder.submit_merge(video_file, audio_file, output_file, audio_offset)
 
-                lst_cmd.append("-c:a aac")
+    def start_piped_recording(self, record_file_name=""):
+        """
+        Hand the detectors the inputs of one encoder process, the muxed file is written while recording
+        """
+        output_file = f"{record_file_name}.mp4"
+        self.release_encoder()
 
-                lst_cmd.append("-b:a 192k")
-                lst_cmd.append("-ac 2")
-                lst_cmd.append(output_file)
-
-
-                cmd = " ".join(lst_cmd)
-                p = subprocess.Popen(cmd, shell=True)
-                (output, err) = p.communicate()
-
-                for file_ in [video_file, audio_file]:
-                    if os.path.exists(file_):
-                        p.wait()
-                        os.remove(file_)
+        try:
+            self.encoder = piped_encoder.PipedRecordingEncoder(output_file,
+                                                               frame_rate=self.motion_detector.frame_rate,
+                                                               size=(self.motion_detector.width, self.motion_detector.height),
+                                                               audio_rate=self.noise_detector.RATE,
+                                                               channels=self.noise_detector.CHANNELS,
+                                                               audio_dtype=self.noise_detector.DTYPE,
+                                                               audio_offset=self.noise_detector.get_preroll_length(),
+                                                               on_done=self.on_record_done)
+        except OSError as e:
+            self.log_manager.log("Error starting the encoder, recording files instead: {0}".format(e))
+            return False
+
+        self.motion_detector.external_writer = self.encoder.video_input
+        self.noise_detector.external_writer = self.encoder.audio_input
+        self.motion_detector.current_file = output_file
+        self.noise_detector.current_file = output_file
+
+        # Nothing to merge afterwards
+        self.is_merged = True
+        return True
+
+    def release_encoder(self):
+        """
+        Close the inputs of the last encoder that a detector never took (the event ended first), so its
+        ffmpeg process and feeder threads finish instead of waiting on their pipes forever
+        """
+        if self.encoder is None:
+            return
+
+        # Called before a new record only: the detectors are not recording and their force_recording is off
+        for detector_, input_ in ((self.motion_detector, self.encoder.video_input), (self.noise_detector, self.encoder.audio_input)):
+            if detector_.external_writer is input_:
+                detector_.external_writer = None
+                input_.close()
+        self.encoder = None
+
+    def prepare_recording(self):
+        """
+        Hand the detectors the files (or encoder inputs) of the next record
+        """
+        record_file_name = self.get_record_path_name()
+
+        if self.record_mode == "piped" and self.do_record and self.start_piped_recording(record_file_name):
+            return
+
+        dir_name = os.path.dirname(record_file_name)
+        base_name = os.path.basename(record_file_name)
+
+        video_file = os.path.join(dir_name, f".{base_name}{transcoder.VIDEO_SUFFIX}")
+        audio_file = os.path.join(dir_name, f".{base_name}{transcoder.AUDIO_SUFFIX}")
+
+        self.motion_detector.current_file = video_file
+        self.noise_detector.current_file = audio_file
+        self.is_merged = False
 
-        except subprocess.CalledProcessError:
-            self.log_manager.log("Error converting merging files!")
+    def on_record_done(self, output_file="", ended=0.0):
+        """
+        Called from the transcoder or encoder threads when `output_file` is in the archive, `ended` is the
+        timestamp the recording ended
+        """
+        pass
 
+    def start_workers(self):
+        """
+        Start the transcoder (picking up recordings left unmerged by a restart) and the detectors
+        """
+        self.transcoder.start()
+        self.transcoder.reconcile(self.media_dir, audio_offset=self.noise_detector.get_preroll_length())
 
-        pass
+        self.motion_detector.start()
+        self.noise_detector.start()
+        self.dht_detector.start()
 
     def merge_data(self):
 
-        self.record_state = self.noise_detector.detect_noise or self.motion_detector.detect_motion
-        self.motion_detector.force_recording = self.record_state
-        self.noise_detector.force_recording = self.record_state
-        output_file = ""
+        self.record_state = self.noise_detector.trigger.active or self.motion_detector.trigger.active
 
         if self.record_state:
             dict_dht_data = self.dht_detector.get_data()
@@ -106,28 +173,24 @@ class ThreadManager(threading.Thread):
                                                                                      dict_dht_data["hum"])
 
             if not (self.motion_detector.current_file and self.noise_detector.current_file):
-                record_file_name = self.get_record_path_name()
-                dir_name = os.path.dirname(record_file_name)
-                base_name = os.path.basename(record_file_name)
-
-                video_file = os.path.join(dir_name, f".{base_name}_video.avi")
-                audio_file = os.path.join(dir_name, f".{base_name}_audio.wav")
-                output_file = f"{record_file_name}.mp4"
+                self.prepare_recording()
 
-                self.motion_detector.current_file = video_file
-                self.noise_detector.current_file = audio_file
-                self.is_merged = False
+        # Raised only once the files are handed over, a detector seeing it earlier would record into a file
+        # of its own that nothing merges (in processes mode the commands are applied in this order too)
+        self.motion_detector.force_recording = self.record_state
+        self.noise_detector.force_recording = self.record_state
 
-        if not self.is_merged and self.noise_detector.last_file and self.motion_detector.last_file and self.motion_detector.saved and self.noise_detector.saved:
-            self.merge_video_and_audio(self.motion_detector.last_file, self.noise_detector.last_file, output_file)
+        # Right after a record is prepared, last_file and saved still describe the previous one
+        last_files = (self.motion_detector.last_file, self.noise_detector.last_file)
+        if not self.is_merged and all(last_files) and last_files != self.merged_files and self.motion_detector.saved and self.noise_detector.saved:
+            self.merge_video_and_audio(*last_files, audio_offset=self.noise_detector.get_preroll_length())
 
+            self.merged_files = last_files
             self.is_merged = True
 
     # def run(self):
     #
-    #     self.motion_detector.start()
-    #     self.noise_detector.start()
-    #     self.dht_detector.start()
+    #     self.start_workers()
     #     self.is_merged = False
     #
     #     while True:
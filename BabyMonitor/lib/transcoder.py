@@ -0,0 +1,268 @@
+import os
+import queue
+import subprocess
+import threading
+import time
+from collections import deque
+
+from BabyMonitor.lib import utils
+
+VIDEO_SUFFIX = "_video.avi"
+AUDIO_SUFFIX = "_audio.wav"
+TEMP_INFIX = ".part"
+FASTSTART_ARGS = ["-movflags", "+faststart"]  # moov atom first: playback starts before the download ends
+
+
+def get_output_file(file_path="", extension=".mp4"):
+    """
+    Visible archive file for a hidden recording: `.{name}_video.avi`, `.{name}_audio.wav` or `.{name}.avi`
+    all give `{name}{extension}`
+    """
+    dir_name, base_name = os.path.split(file_path)
+    base_name = base_name.lstrip(".")
+    for suffix_ in (VIDEO_SUFFIX, AUDIO_SUFFIX):
+        if base_name.endswith(suffix_):
+            base_name = base_name[:-len(suffix_)]
+            break
+    else:
+        base_name = os.path.splitext(base_name)[0]
+    return os.path.join(dir_name, "{0}{1}".format(base_name, extension))
+
+
+def get_temp_file(output_file=""):
+    # Hidden, and keeps the extension so ffmpeg still picks the container from it
+    dir_name, base_name = os.path.split(output_file)
+    name, extension = os.path.splitext(base_name)
+    return os.path.join(dir_name, ".{0}{1}{2}".format(name, TEMP_INFIX, extension))
+
+
+def lower_priority(pid=0, nice=19):
+    """
+    Lower the priority of a started child process. Set from here after Popen, not in the child with a
+    preexec_fn, which may deadlock before exec in a process running threads.
+    """
+    try:
+        os.setpriority(os.PRIO_PROCESS, pid, nice)
+    except OSError:
+        pass  # Exited already
+
+
+class TranscodeJob:
+
+    def __init__(self, lst_args=(), lst_inputs=(), output_file="", lst_input_args=()):
+        self.lst_args = list(lst_args)
+        self.lst_inputs = list(lst_inputs)
+        self.lst_input_args = list(lst_input_args) or [[] for input_ in self.lst_inputs]  # Options for every input
+        self.output_file = output_file
+
+        self.created = time.time()
+        self.started = 0.0
+        self.finished = 0.0
+        self.returncode = None
+
+    @property
+    def wait_time(self):
+        return (self.started or time.time()) - self.created
+
+    @property
+    def duration(self):
+        return (self.finished or time.time()) - self.started if self.started else 0.0
+
+    def get_cmd(self):
+        lst_cmd = ["ffmpeg", "-nostdin", "-y", "-loglevel", "error"]
+        for input_, lst_input_args_ in zip(self.lst_inputs, self.lst_input_args):
+            lst_cmd += list(lst_input_args_) + ["-i", input_]
+        return lst_cmd + self.lst_args + [get_temp_file(self.output_file)]
+
+    def to_dict(self):
+        return {
+            "output_file": os.path.basename(self.output_file),
+            "wait_time": round(self.wait_time, 3),
+            "duration": round(self.duration, 3),
+            "returncode": self.returncode,
+        }
+
+
+class TranscodeQueue:
+    """
+    ffmpeg jobs run by a bounded pool of low priority worker threads, so capture never waits on an encode
+
+    A job's inputs are only removed once its output is complete, so whatever is left in the media dir after
+    a restart is picked up again by reconcile(). Listeners are called with (output_file, recording end
+    timestamp) for every complete output.
+    """
+
+    def __init__(self, workers=1, nice=19, history_length=50):
+        self.name = str(self.__class__.__name__)
+        self.log_manager = utils.LogManager(self.name)
+
+        self.workers = workers
+        self.nice = nice
+
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.set_outputs = set()  # Queued or running outputs, so a file is never submitted twice
+        self.lst_running = []
+        self.deque_finished = deque(maxlen=history_length)
+        self.failed = 0
+        self.lst_threads = []
+        self.lst_listeners = []
+
+    def add_listener(self, callback):
+        self.lst_listeners.append(callback)
+
+    def start(self):
+        with self.lock:
+            while len(self.lst_threads) < self.workers:
+                thread = threading.Thread(target=self.run, name="{0}-{1}".format(self.name, len(self.lst_threads)), daemon=True)
+                thread.start()
+                self.lst_threads.append(thread)
+
+    def submit(self, job):
+        with self.lock:
+            if job.output_file in self.set_outputs:
+                return None
+            self.set_outputs.add(job.output_file)
+
+        self.start()
+        self.queue.put(job)
+        self.log_manager.log("Queued {0} ({1} waiting)".format(os.path.basename(job.output_file), self.queue.qsize()))
+        return job
+
+    def submit_merge(self, video_file="", audio_file="", output_file="", audio_offset=0.0):
+        # ffmpeg -i video.avi -i audio.wav -c:v libx264 -crf 19 -preset slow -c:a aac -b:a 192k -ac 2 out.mp4
+        # `audio_offset` seconds of audio (pre-roll) precede the first video frame
+        lst_args = ["-c:v", "libx264", "-crf", "19", "-preset", "slow",
+                    "-c:a", "aac", "-b:a", "192k", "-ac", "2"] + FASTSTART_ARGS
+        lst_input_args = [["-itsoffset", "{0:.3f}".format(audio_offset)] if audio_offset else [], []]
+        return self.submit(TranscodeJob(lst_args, [video_file, audio_file], output_file or get_output_file(video_file), lst_input_args))
+
+    def submit_convert(self, file_path="", extension=".mp4", lst_args=()):
+        lst_args = list(lst_args) + (FASTSTART_ARGS if extension == ".mp4" else [])
+        return self.submit(TranscodeJob(lst_args, [file_path], get_output_file(file_path, extension)))
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            with self.lock:
+                self.lst_running.append(job)
+
+            try:
+                self.process(job)
+            finally:
+                with self.lock:
+                    self.lst_running.remove(job)
+                    self.set_outputs.discard(job.output_file)
+                    self.deque_finished.append(job)
+
+    def process(self, job):
+        job.started = time.time()
+        temp_file = get_temp_file(job.output_file)
+
+        try:
+            p = subprocess.Popen(job.get_cmd())
+            if self.nice:
+                lower_priority(p.pid, self.nice)
+            job.returncode = p.wait()
+        except OSError as e:
+            self.log_manager.log("Error running ffmpeg: {0}".format(e))
+            job.returncode = -1
+
+        job.finished = time.time()
+
+        if job.returncode == 0 and os.path.exists(temp_file):
+            os.replace(temp_file, job.output_file)
+            # Recordings are written until the event ends, the newest input tells when that was
+            ended = max([os.path.getmtime(file_) for file_ in job.lst_inputs if os.path.exists(file_)] or [job.created])
+            for file_ in job.lst_inputs:
+                if os.path.exists(file_):
+                    os.remove(file_)
+            self.log_manager.log("Done {0} in {1:.1f} s".format(os.path.basename(job.output_file), job.duration))
+            self.notify(job.output_file, ended)
+        else:
+            self.failed += 1
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            self.log_manager.log("Error converting {0} (exit code {1})".format(os.path.basename(job.output_file), job.returncode))
+
+    def notify(self, output_file="", ended=0.0):
+        for callback_ in self.lst_listeners:
+            try:
+                callback_(output_file, ended)
+            except Exception as e:
+                self.log_manager.log("Error in listener of {0}: {1}".format(os.path.basename(output_file), e))
+
+    def reconcile(self, media_dir="", lst_active=(), audio_offset=0.0):
+        """
+        Queue the leftovers of jobs interrupted by a restart: hidden `_video.avi`/`_audio.wav` pairs are merged,
+        single hidden recordings converted, half written outputs removed. `lst_active` are files still recording,
+        `audio_offset` the pre-roll the audio files start with (as in submit_merge).
+        """
+        if not os.path.isdir(media_dir):
+            return 0
+
+        set_files = set(file_ for file_ in os.listdir(media_dir) if file_.startswith("."))
+        set_files -= set(os.path.basename(file_) for file_ in lst_active if file_)
+        count = 0
+
+        for file_ in sorted(set_files):
+            file_path = os.path.join(media_dir, file_)
+            extension = os.path.splitext(file_)[1]
+            job = None
+
+            if TEMP_INFIX + "." in file_:
+                with self.lock:
+                    is_running = any(get_temp_file(output_) == file_path for output_ in self.set_outputs)
+                if not is_running:
+                    os.remove(file_path)
+            elif file_.endswith(VIDEO_SUFFIX):
+                audio_file = file_[:-len(VIDEO_SUFFIX)] + AUDIO_SUFFIX
+                if audio_file in set_files:
+                    job = self.submit_merge(file_path, os.path.join(media_dir, audio_file), audio_offset=audio_offset)
+                else:
+                    job = self.submit_convert(file_path, ".mp4")
+            elif file_.endswith(AUDIO_SUFFIX):
+                if file_[:-len(AUDIO_SUFFIX)] + VIDEO_SUFFIX not in set_files:
+                    job = self.submit_convert(file_path, ".mp3", ["-f", "mp3"])
+            elif extension == ".avi":
+                job = self.submit_convert(file_path, ".mp4")
+            elif extension == ".wav":
+                job = self.submit_convert(file_path, ".mp3", ["-f", "mp3"])
+
+            count += job is not None
+
+        if count:
+            self.log_manager.log("Reconciled {0} unfinished recordings in {1}".format(count, media_dir))
+        return count
+
+    def get_stats(self):
+        with self.lock:
+            lst_finished = list(self.deque_finished)
+            lst_running = list(self.lst_running)
+
+        lst_durations = [job_.duration for job_ in lst_finished]
+        return {
+            "queued": self.queue.qsize(),
+            "running": len(lst_running),
+            "workers": self.workers,
+            "failed": self.failed,
+            "mean_duration": round(sum(lst_durations) / len(lst_durations), 3) if lst_durations else 0.0,
+            "max_duration": round(max(lst_durations), 3) if lst_durations else 0.0,
+            "running_jobs": [job_.to_dict() for job_ in lst_running],
+            "finished_jobs": [job_.to_dict() for job_ in lst_finished],
+        }
+
+
+default_queue = None
+default_queue_lock = threading.Lock()
+
+
+def get_default_queue():
+    """
+    Transcoding queue shared by the detectors and the ThreadManager
+    """
+    global default_queue
+    with default_queue_lock:
+        if default_queue is None:
+            default_queue = TranscodeQueue(workers=int(os.environ.get("TRANSCODE_WORKERS", "1")))
+        return default_queue
@@ -0,0 +1,56 @@
+import time
+from collections import deque
+
+
+class SlidingWindowTrigger:
+    """
+    Detection state over the last `window_length` observations, O(1) per observation
+
+    The trigger switches on when at least `on_count` observations in the window are above the threshold and
+    off when at most `off_count` are, but only after having been on (off) for `min_on_time` (`min_off_time`)
+    seconds. The defaults (1, 0, 0.0, 0.0) mean "anything above the threshold within the window".
+    """
+
+    def __init__(self, window_length=75, on_count=1, off_count=0, min_on_time=0.0, min_off_time=0.0):
+        self.window_length = max(1, int(window_length))
+        self.on_count = on_count
+        self.off_count = off_count
+        self.min_on_time = min_on_time
+        self.min_off_time = min_off_time
+
+        self.deque_window = deque(maxlen=self.window_length)
+        self.count = 0  # Observations above the threshold in the window
+        self.active = False
+        self.changed_at = 0.0
+
+    def __bool__(self):
+        return self.active
+
+    def reset(self):
+        self.deque_window.clear()
+        self.count = 0
+        self.active = False
+        self.changed_at = 0.0
+
+    def update(self, is_above=False, now=None):
+        """
+        @param bool is_above: the newest observation is above the threshold
+        @return bool: trigger state
+        """
+        now = time.time() if now is None else now
+        is_above = bool(is_above)
+
+        if len(self.deque_window) == self.window_length:
+            self.count -= self.deque_window[0]
+        self.deque_window.append(is_above)
+        self.count += is_above
+
+        if not self.active:
+            if self.count >= self.on_count and now - self.changed_at >= self.min_off_time:
+                self.active = True
+                self.changed_at = now
+        elif self.count <= self.off_count and now - self.changed_at >= self.min_on_time:
+            self.active = False
+            self.changed_at = now
+
+        return self.active
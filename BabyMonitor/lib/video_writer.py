@@ -0,0 +1,64 @@
+import queue
+import threading
+import cv2
+
+from BabyMonitor.lib import frame_resampler
+
+
+class BackgroundVideoWriter:
+    """
+    Write frames to a constant frame rate video file from a background thread while recording
+
+    Frames are (timestamp, frame) pairs at whatever rate the camera delivers them. Every output slot of
+    1 / frame_rate seconds gets the closest captured frame (see FrameResampler), so frames are duplicated
+    or dropped on the fly.
+    The queue is bounded: if the disk cannot keep up, new frames are dropped (and counted) instead of
+    piling up in memory.
+    """
+
+    def __init__(self, file_path="", codec=None, frame_rate=15, size=(640, 480), queue_size=30):
+        self.file_path = file_path
+        self.codec = codec if codec is not None else cv2.VideoWriter_fourcc(*'MJPG')
+        self.frame_rate = frame_rate
+        self.size = size
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0  # Frames dropped because the queue was full
+        self.resampler = frame_resampler.FrameResampler(frame_rate)
+
+        self.thread = threading.Thread(target=self.run, name="{0}-{1}".format(self.__class__.__name__, file_path), daemon=True)
+        self.thread.start()
+
+    def write(self, timestamp, frame):
+        try:
+            self.queue.put_nowait((timestamp, frame))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """
+        Flush the queued frames and release the file
+        """
+        self.queue.put((None, None))
+        self.thread.join()
+
+    def get_stats(self):
+        dict_stats = self.resampler.get_stats()
+        dict_stats["queue_dropped"] = self.dropped
+        return dict_stats
+
+    def run(self):
+        writer = cv2.VideoWriter(self.file_path, self.codec, self.frame_rate, self.size)
+
+        while True:
+            timestamp, frame = self.queue.get()
+            if timestamp is None:
+                break
+
+            for frame_ in self.resampler.push(timestamp, frame):
+                writer.write(frame_)
+
+        for frame_ in self.resampler.flush():
+            writer.write(frame_)
+
+        writer.release()
@@ -0,0 +1,178 @@
+import os
+import queue
+import struct
+import threading
+import numpy as np
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+
+HEADER_SIZE = 0x2c  # RIFF + fmt + data headers, 44 bytes
+HEADER_STRUCT = struct.Struct('<4sI4s4sIHHIIHH4sI')
+
+# Little-endian sample types and their WAVE format tags
+DICT_FORMAT_TAGS = {
+    np.dtype('<f4'): WAVE_FORMAT_IEEE_FLOAT,
+    np.dtype('<i2'): WAVE_FORMAT_PCM,
+}
+
+
+def get_format_tag(dtype):
+    dtype = np.dtype(dtype).newbyteorder('<')
+    if dtype not in DICT_FORMAT_TAGS:
+        raise ValueError("Unsupported sample type: {0}".format(dtype))
+    return DICT_FORMAT_TAGS[dtype]
+
+
+def get_header(data_size=0, rate=48000, channels=1, dtype=np.float32):
+    """
+    Build the 44 bytes WAVE header for a data-part of `data_size` bytes
+
+    @param int data_size
+    @return bytes
+    """
+    dtype = np.dtype(dtype)
+    format_tag = get_format_tag(dtype)
+    frame_size = channels * dtype.itemsize
+
+    return HEADER_STRUCT.pack(b'RIFF', data_size + HEADER_SIZE - 8, b'WAVE',
+                              b'fmt ', 0x10, format_tag, channels, rate, rate * frame_size, frame_size, dtype.itemsize * 8,
+                              b'data', data_size)
+
+
+def to_samples(data, dtype=np.float32):
+    """
+    View raw audio bytes (or an array) as little-endian samples without copying when possible
+
+    @param bytes|numpy-Array data
+    @return numpy-Array
+    """
+    dtype = np.dtype(dtype).newbyteorder('<')
+    if isinstance(data, np.ndarray):
+        return np.ascontiguousarray(data, dtype=dtype)
+    return np.frombuffer(data, dtype=dtype)
+
+
+def generate_wav(data, rate=48000, channels=1, dtype=np.float32):
+    """
+    Create WAVE-file content from raw audio data in one pass
+
+    @param bytes|numpy-Array data
+    @return bytes
+    """
+    samples = to_samples(data, dtype)
+    return get_header(samples.nbytes, rate, channels, samples.dtype) + samples.tobytes()
+
+
+class WavWriter:
+    """
+    Append audio chunks to an open WAVE-file and patch the RIFF sizes on close
+    """
+
+    def __init__(self, file_path="", rate=48000, channels=1, dtype=np.float32):
+        self.file_path = file_path
+        self.rate = rate
+        self.channels = channels
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self.data_size = 0
+
+        get_format_tag(self.dtype)
+
+        self.file = open(self.file_path, "wb")
+        self.file.write(get_header(0, self.rate, self.channels, self.dtype))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    @property
+    def duration(self):
+        return self.data_size / (self.rate * self.channels * self.dtype.itemsize)
+
+    def write(self, data):
+        samples = to_samples(data, self.dtype)
+        self.file.write(samples.data)
+        self.data_size += samples.nbytes
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        self.file.seek(0, os.SEEK_SET)
+        self.file.write(get_header(self.data_size, self.rate, self.channels, self.dtype))
+        self.file.close()
+
+
+class BufferedWavWriter(WavWriter):
+    """
+    WavWriter with a fixed-size in-memory buffer, full segments are spilled to disk by a background thread
+    """
+
+    def __init__(self, file_path="", rate=48000, channels=1, dtype=np.float32, buffer_length=4.0, segment_count=4):
+        WavWriter.__init__(self, file_path, rate, channels, dtype)
+
+        segment_count = max(2, segment_count)
+        segment_size = max(1, int(buffer_length * rate / segment_count)) * channels
+
+        self.free_segments = queue.Queue()
+        self.full_segments = queue.Queue()
+        for i in range(segment_count):
+            self.free_segments.put(np.empty(segment_size, dtype=self.dtype))
+
+        self.buffer_size = segment_count * segment_size * self.dtype.itemsize  # Bytes held in memory, whatever the length
+
+        self.segment = self.free_segments.get()
+        self.segment_pos = 0
+        self.overruns = 0  # How many times capture had to wait for the disk
+
+        self.thread = threading.Thread(target=self.spill, name="{0}-spill".format(self.__class__.__name__), daemon=True)
+        self.thread.start()
+
+    def spill(self):
+        while True:
+            segment, size = self.full_segments.get()
+            if segment is None:
+                break
+
+            WavWriter.write(self, segment[:size])
+            self.free_segments.put(segment)
+
+    def next_segment(self):
+        self.full_segments.put((self.segment, self.segment_pos))
+
+        try:
+            self.segment = self.free_segments.get_nowait()
+        except queue.Empty:
+            self.overruns += 1
+            self.segment = self.free_segments.get()
+
+        self.segment_pos = 0
+
+    def write(self, data):
+        samples = to_samples(data, self.dtype)
+
+        while samples.size:
+            size = min(samples.size, self.segment.size - self.segment_pos)
+            self.segment[self.segment_pos:self.segment_pos + size] = samples[:size]
+            self.segment_pos += size
+            samples = samples[size:]
+
+            if self.segment_pos == self.segment.size:
+                self.next_segment()
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        if self.segment_pos:
+            self.full_segments.put((self.segment, self.segment_pos))
+        self.full_segments.put((None, 0))
+        self.thread.join()
+
+        WavWriter.close(self)
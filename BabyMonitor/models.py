@@ -1,9 +1,12 @@
 
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy import event, func, literal, text
+from sqlalchemy.dialects.sqlite import insert
 
 from BabyMonitor import db
 import datetime
+import os
 
 class User(db.Model):
 
@@ -29,7 +32,7 @@ class User(db.Model):
 class Detections(db.Model):
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now, index=True)
     motion = db.Column(db.Float)
     noise = db.Column(db.Float)
 
@@ -41,7 +44,7 @@ class Detections(db.Model):
 class WeatherMeasures(db.Model):
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now, index=True)
     temperature = db.Column(db.Float)
     humidity = db.Column(db.Float)
 
@@ -51,6 +54,401 @@ class WeatherMeasures(db.Model):
                f'temperature: {self.temperature} {degree_sign}, ' \
                f'humidity: {self.humidity} %>'
 
+def get_rows_after(model, last_id=0, limit=500):
+    """
+    Rows added after `last_id`, oldest first, through the primary key index
+    """
+    return model.query.filter(model.id > last_id).order_by(model.id).limit(limit).all()
+
+
+def get_cursor_before(model, timestamp):
+    """
+    Id of the newest row older than `timestamp`, 0 if there is none: rows after it are the ones since `timestamp`
+
+    Ids grow with the timestamps, so walking the primary key backwards only reads the rows since `timestamp`.
+    """
+    row = model.query.with_entities(model.id).filter(model.timestamp < timestamp).order_by(model.id.desc()).first()
+    return row[0] if row else 0
+
+
+class Rollup(db.Model):
+    """
+    Minimum, maximum, sum and count of a series over one minute, hour or day (`resolution` in seconds)
+    """
+
+    __table_args__ = (db.UniqueConstraint("series", "resolution", "timestamp"),)
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    series = db.Column(db.String(32), nullable=False)
+    resolution = db.Column(db.Integer, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)  # Start of the bucket
+    minimum = db.Column(db.Float)
+    maximum = db.Column(db.Float)
+    total = db.Column(db.Float)
+    count = db.Column(db.Integer)
+
+    def __repr__(self):
+        return f'<Rollup {self.series}/{self.resolution} [{self.timestamp}] ' \
+               f'min: {self.minimum}, max: {self.maximum}, count: {self.count}>'
+
+# Series of the charts: name -> (model, column)
+DICT_SERIES = {
+    "temperature": (WeatherMeasures, "temperature"),
+    "humidity": (WeatherMeasures, "humidity"),
+    "motion": (Detections, "motion"),
+    "noise": (Detections, "noise"),
+}
+DICT_RESOLUTIONS = {60: "minute", 3600: "hour", 86400: "day"}
+DICT_ROLLUP_RETENTION = {60: 30, 3600: 365, 86400: 0}  # Days the rollups are kept, 0: forever
+BUCKET_ORIGIN = datetime.datetime(2000, 1, 1)  # Midnight, so day buckets start at midnight
+
+
+def get_bucket(timestamp, resolution):
+    """
+    Start of the `resolution` seconds long bucket holding `timestamp`
+    """
+    return timestamp - (timestamp - BUCKET_ORIGIN) % datetime.timedelta(seconds=resolution)
+
+
+def fill_buckets(dict_buckets, lst_rows):
+    """
+    Add WeatherMeasures and Detections rows to `dict_buckets`: (series, resolution, bucket) -> [min, max, sum, count]
+    """
+    for row_ in lst_rows:
+        for series_, (model_, column_) in DICT_SERIES.items():
+            value = getattr(row_, column_) if isinstance(row_, model_) else None
+            if value is None:
+                continue
+
+            for resolution_ in DICT_RESOLUTIONS:
+                key = (series_, resolution_, get_bucket(row_.timestamp, resolution_))
+                bucket = dict_buckets.get(key)
+                if bucket is None:
+                    dict_buckets[key] = [value, value, value, 1]
+                else:
+                    bucket[0], bucket[1] = min(bucket[0], value), max(bucket[1], value)
+                    bucket[2] += value
+                    bucket[3] += 1
+    return dict_buckets
+
+
+def get_bucket_rows(dict_buckets):
+    return [{"series": series_, "resolution": resolution_, "timestamp": timestamp_,
+             "minimum": bucket_[0], "maximum": bucket_[1], "total": bucket_[2], "count": bucket_[3]}
+            for (series_, resolution_, timestamp_), bucket_ in dict_buckets.items()]
+
+
+def add_to_rollups(lst_rows):
+    """
+    Add new WeatherMeasures and Detections rows to the rollups of their series, in the session of the rows
+
+    The rows are summed up per bucket first, then merged into the table with one upsert statement for all
+    the buckets.
+    """
+    for row_ in lst_rows:
+        if row_.timestamp is None:
+            row_.timestamp = datetime.datetime.now()  # Column default, needed before the flush
+
+    dict_buckets = fill_buckets({}, lst_rows)
+    if not dict_buckets:
+        return 0
+
+    statement = insert(Rollup)
+    statement = statement.on_conflict_do_update(
+        index_elements=[Rollup.series, Rollup.resolution, Rollup.timestamp],
+        set_={"minimum": func.min(Rollup.minimum, statement.excluded.minimum),
+              "maximum": func.max(Rollup.maximum, statement.excluded.maximum),
+              "total": Rollup.total + statement.excluded.total,
+              "count": Rollup.count + statement.excluded.count})
+    db.session.execute(statement, get_bucket_rows(dict_buckets))
+    return len(dict_buckets)
+
+
+def rebuild_rollups(batch_size=5000):
+    """
+    Compute the rollups of all the rows again, e.g. for a database older than the rollups
+    """
+    Rollup.query.delete()
+
+    dict_buckets = {}
+    for model_ in set(model_ for model_, column_ in DICT_SERIES.values()):
+        last_id = 0
+        while True:
+            lst_rows = get_rows_after(model_, last_id, batch_size)
+            if not lst_rows:
+                break
+            fill_buckets(dict_buckets, lst_rows)
+            last_id = lst_rows[-1].id
+            db.session.expunge_all()
+
+    if dict_buckets:
+        db.session.execute(insert(Rollup), get_bucket_rows(dict_buckets))
+    db.session.commit()
+    return len(dict_buckets)
+
+
+def get_range_rows(series, start, end, resolution=0):
+    """
+    (timestamp, min, max, sum, count) of `series` between `start` and `end`: the buckets of `resolution` that
+    lie within the range, the partial buckets at its edges from the next finer rollup, down to the rows
+    """
+    model, column = DICT_SERIES[series]
+    if not resolution:
+        value = getattr(model, column)
+        query = model.query.with_entities(model.timestamp, value, value, value, literal(1))
+        query = query.filter(model.timestamp >= start, model.timestamp < end, value.isnot(None))
+        return query.order_by(model.timestamp).all()
+
+    finer = max((resolution_ for resolution_ in DICT_RESOLUTIONS if resolution_ < resolution), default=0)
+    first = get_bucket(start, resolution)
+    if first < start:
+        first += datetime.timedelta(seconds=resolution)
+    last = get_bucket(end, resolution)  # End of the last bucket within the range
+    if last <= first:
+        return get_range_rows(series, start, end, finer)
+
+    query = Rollup.query.with_entities(Rollup.timestamp, Rollup.minimum, Rollup.maximum, Rollup.total, Rollup.count)
+    query = query.filter(Rollup.series == series, Rollup.resolution == resolution,
+                         Rollup.timestamp >= first, Rollup.timestamp < last)
+    lst_rows = get_range_rows(series, start, first, finer) if start < first else []
+    lst_rows += query.order_by(Rollup.timestamp).all()
+    if last < end:
+        lst_rows += get_range_rows(series, last, end, finer)
+    return lst_rows
+
+
+def get_range(series, start, end, points=500):
+    """
+    Values of `series` between `start` and `end` in at most `points` buckets of min, max, mean and count
+
+    They are read from the coarsest rollup with at least `points` buckets in the range (the partial buckets
+    at its edges from the finer ones), or from the rows when the range is too short for the minute rollup,
+    and merged into the `points` buckets. Edges older than the finer rollups and the rows are kept may
+    come out empty.
+
+    @return dict: resolution read, bucket length in seconds and the non-empty buckets, oldest first
+    """
+    width = (end - start) / points
+
+    lst_fitting = [resolution_ for resolution_ in DICT_RESOLUTIONS if resolution_ <= width.total_seconds()]
+    resolution = max(lst_fitting) if lst_fitting else 0
+    lst_rows = get_range_rows(series, start, end, resolution)
+
+    dict_points = {}
+    for timestamp_, minimum_, maximum_, total_, count_ in lst_rows:
+        index = min(max(int((timestamp_ - start) / width), 0), points - 1)
+        point = dict_points.get(index)
+        if point is None:
+            dict_points[index] = [minimum_, maximum_, total_, count_]
+        else:
+            point[0], point[1] = min(point[0], minimum_), max(point[1], maximum_)
+            point[2] += total_
+            point[3] += count_
+
+    return {
+        "series": series,
+        "resolution": DICT_RESOLUTIONS.get(resolution, "raw"),
+        "bucket_seconds": width.total_seconds(),
+        "points": [{"timestamp": (start + width * index_).strftime('%Y-%m-%d %H:%M:%S'),
+                    "min": point_[0], "max": point_[1], "mean": point_[2] / point_[3], "count": point_[3]}
+                   for index_, point_ in sorted(dict_points.items())],
+    }
+
+
+def prune_rows(max_age=7, batch_size=1000):
+    """
+    Delete the WeatherMeasures and Detections rows older than `max_age` days, they are in the rollups since
+    they were written, and the rollups older than DICT_ROLLUP_RETENTION
+
+    Rows go in batches of `batch_size` consecutive ids, one short transaction each, so the writer is never
+    held up for long.
+
+    @return int: number of rows deleted
+    """
+    now = datetime.datetime.now()
+    count = 0
+
+    for model_ in (Detections, WeatherMeasures):
+        last_id = get_cursor_before(model_, now - datetime.timedelta(days=max_age))
+        first_id = db.session.query(func.min(model_.id)).scalar() or 0
+        while first_id and first_id <= last_id:
+            count += model_.query.filter(model_.id <= min(first_id + batch_size - 1, last_id)).delete()
+            db.session.commit()
+            first_id += batch_size
+
+    for resolution_, days_ in DICT_ROLLUP_RETENTION.items():
+        if days_:
+            count += Rollup.query.filter(Rollup.resolution == resolution_,
+                                         Rollup.timestamp < now - datetime.timedelta(days=days_)).delete()
+            db.session.commit()
+
+    if count:
+        # Give the WAL file back, the freed pages of the database are reused by the next rows
+        db.session.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+    return count
+
+
+class MediaRecord(db.Model):
+    """
+    Catalog of the archive: one row per complete recording
+    """
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    filename = db.Column(db.String, unique=True, nullable=False)
+    type = db.Column(db.String(8), nullable=False)
+    size = db.Column(db.Integer)
+    started = db.Column(db.DateTime, nullable=False, index=True)
+    ended = db.Column(db.DateTime)
+    duration = db.Column(db.Float)  # Seconds, None when the start is unknown
+    peak_motion = db.Column(db.Float)
+    peak_noise = db.Column(db.Float)
+
+    def to_dict(self):
+        return {
+            "filename": self.filename,
+            "type": self.type,
+            "size": self.size,
+            "started": self.started.strftime('%Y-%m-%d %H:%M:%S'),
+            "ended": self.ended.strftime('%Y-%m-%d %H:%M:%S') if self.ended else None,
+            "duration": self.duration,
+            "peak_motion": self.peak_motion,
+            "peak_noise": self.peak_noise,
+        }
+
+    def __repr__(self):
+        return f'<MediaRecord {self.filename} [{self.started}] ' \
+               f'duration: {self.duration}, motion: {self.peak_motion}, noise: {self.peak_noise}>'
+
+
+MAX_RECORD_LENGTH = datetime.timedelta(days=1)
+
+
+def get_media_type(filename):
+    name, extension = os.path.splitext(filename)
+    return 'video' if extension in ['.mp4', '.avi'] else 'audio'
+
+
+def get_record_start(filename):
+    """
+    Start of a recording from its name (utils.get_timestamp() + extension), None for other names
+    """
+    try:
+        return datetime.datetime.strptime(filename[:15], "%Y%m%d_%H%M%S")
+    except ValueError:
+        return None
+
+
+def get_media_record_values(filename, size, ended):
+    """
+    Catalog columns of a complete recording, with the peak motion and noise of the detections written while
+    it was recorded
+    """
+    started = get_record_start(filename)
+    if started is not None and not started <= ended <= started + MAX_RECORD_LENGTH:
+        ended = None  # Not the end of the recording, e.g. the modification time of a copied file
+
+    peak_motion = peak_noise = None
+    if started is not None and ended is not None:
+        peak_motion, peak_noise = db.session.query(func.max(Detections.motion), func.max(Detections.noise)).filter(
+            Detections.timestamp >= started, Detections.timestamp <= ended).one()
+
+    return {"filename": filename, "type": get_media_type(filename), "size": size, "started": started or ended,
+            "ended": ended, "duration": (ended - started).total_seconds() if started and ended else None,
+            "peak_motion": peak_motion, "peak_noise": peak_noise}
+
+
+def add_media_record(filename, size, ended):
+    """
+    Add or update the catalog row of a complete recording
+    """
+    dict_values = get_media_record_values(filename, size, ended)
+
+    # One statement: the retention thread may catalog the same new file meanwhile (reconcile_media_records)
+    statement = insert(MediaRecord).values(dict_values)
+    statement = statement.on_conflict_do_update(index_elements=[MediaRecord.filename],
+                                                set_={name_: statement.excluded[name_] for name_ in dict_values if name_ != "filename"})
+    db.session.execute(statement)
+    db.session.commit()
+
+
+def remove_media_record(filename):
+    MediaRecord.query.filter_by(filename=filename).delete()
+    db.session.commit()
+
+
+def reconcile_media_records(dict_files):
+    """
+    Catalog exactly the archive files in `dict_files` (name -> (mtime, size)): rows are added for new files,
+    the file's modification time taken as the end of the recording, and removed for files that are gone
+
+    @return tuple: (rows added, rows removed)
+    """
+    set_known = set(filename_ for filename_, in MediaRecord.query.with_entities(MediaRecord.filename))
+
+    lst_new = sorted(set(dict_files) - set_known)
+    lst_values = []
+    for filename_ in lst_new:
+        mtime, size = dict_files[filename_]
+        lst_values.append(get_media_record_values(filename_, size, datetime.datetime.fromtimestamp(mtime)))
+    if lst_values:
+        # Rows added by add_media_record since set_known was read are kept, they know the real end
+        db.session.execute(insert(MediaRecord).on_conflict_do_nothing(index_elements=[MediaRecord.filename]), lst_values)
+
+    lst_gone = sorted(set_known - set(dict_files))
+    if lst_gone:
+        MediaRecord.query.filter(MediaRecord.filename.in_(lst_gone)).delete()
+
+    db.session.commit()
+    return len(lst_new), len(lst_gone)
+
+
+def get_media_records(page=1, per_page=50, type=None, start=None, end=None, min_motion=None, min_noise=None):
+    """
+    Catalog rows, newest first, filtered by type, start between `start` and `end`, peak motion and noise
+
+    @return flask_sqlalchemy.pagination.Pagination
+    """
+    query = MediaRecord.query
+    if type:
+        query = query.filter(MediaRecord.type == type)
+    if start is not None:
+        query = query.filter(MediaRecord.started >= start)
+    if end is not None:
+        query = query.filter(MediaRecord.started < end)
+    if min_motion is not None:
+        query = query.filter(MediaRecord.peak_motion >= min_motion)
+    if min_noise is not None:
+        query = query.filter(MediaRecord.peak_noise >= min_noise)
+    return query.order_by(MediaRecord.started.desc(), MediaRecord.id.desc()).paginate(page=page, per_page=per_page, error_out=False)
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL: readers (the chart streams) do not block the writer and the other way round. synchronous=NORMAL
+    # only syncs at checkpoints, a power cut may lose the last commits but never corrupts the database.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+
+def init_db():
+    """
+    Create the missing tables and indexes, and the rollups of a database that has rows but no rollups yet
+    """
+    if db.engine.dialect.name == "sqlite" and not event.contains(db.engine, "connect", set_sqlite_pragmas):
+        db.engine.dispose()  # Connections opened before get the pragmas too
+        event.listen(db.engine, "connect", set_sqlite_pragmas)
+
+    db.create_all()
+    for model_ in (Detections, WeatherMeasures):
+        for index_ in model_.__table__.indexes:
+            index_.create(db.engine, checkfirst=True)  # create_all() skips the indexes of existing tables
+
+    if Rollup.query.first() is None and (Detections.query.first() or WeatherMeasures.query.first()):
+        rebuild_rollups()
+
+
 class IpClient(db.Model):
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
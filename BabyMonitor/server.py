@@ -1,15 +1,20 @@
 import os
 import threading
 import time
+import datetime
 from functools import wraps
 import json
 
-from flask import Flask, render_template, Response, send_file, redirect, url_for, request, session, g
+from flask import Flask, render_template, Response, send_from_directory, redirect, url_for, request, session, g, jsonify
 from flask_socketio import SocketIO
 
-from BabyMonitor.models import User, IpClient, Detections, WeatherMeasures
+from BabyMonitor.models import User, IpClient, Detections, WeatherMeasures, get_rows_after, get_cursor_before
+from BabyMonitor.models import DICT_SERIES, add_to_rollups, get_range, init_db, prune_rows
+from BabyMonitor.models import add_media_record, remove_media_record, reconcile_media_records, get_media_records, get_media_type
 
 from BabyMonitor.lib.thread_manager import ThreadManager
+from BabyMonitor.lib.db_writer import DbWriter
+from BabyMonitor.lib.retention import RetentionManager, MediaIndex
 from BabyMonitor.lib import utils
 
 from BabyMonitor import create_app
@@ -20,6 +25,11 @@ MEDIA_DIR = os.path.abspath("./media")
 app = create_app()
 socketio = SocketIO(app, async_mode='threading')
 
+db_writer = DbWriter(app, db, on_batch=add_to_rollups,
+					 queue_size=int(os.environ.get("DB_QUEUE_SIZE", "1000")),
+					 batch_size=int(os.environ.get("DB_BATCH_SIZE", "100")),
+					 commit_interval=float(os.environ.get("DB_COMMIT_INTERVAL", "1.0")))
+
 def get_client_ip():
 	return request.environ.get('HTTP_X_REAL_IP', request.remote_addr)
 
@@ -126,8 +136,10 @@ def live():
 @app.route('/videostream')
 def videostream():
 	def gen_video():
+		broadcaster = thread_manager.motion_detector.broadcaster
+		version = 0
 		while True:
-			frame = thread_manager.motion_detector.get_frame()
+			version, frame = broadcaster.wait_for_frame(version)
 
 			if frame is not None:
 				yield (b'--frame\r\n'
@@ -154,53 +166,143 @@ def archive_item(filename):
 @app.route('/archive/delete/<string:filename>')
 def archive_delete(filename):
 	os.remove(MEDIA_DIR + "/" + filename)
+	remove_media_record(filename)
 	return redirect(url_for('archive'))
 
+ARCHIVE_PAGE_SIZE = 50
+
+def parse_float(value):
+	return float(value) if value else None
+
+@app.route('/archive/records')
+@login_required
+def archive_records():
+	"""
+	Page of the archive catalog, newest first: ?page=, ?per_page=, ?type= (video, audio), ?start=, ?end= (ISO
+	dates, recording start), ?min_motion=, ?min_noise= (peak values)
+	"""
+	try:
+		start = parse_timestamp(request.args.get("start"), None)
+		end = parse_timestamp(request.args.get("end"), None)
+		min_motion = parse_float(request.args.get("min_motion"))
+		min_noise = parse_float(request.args.get("min_noise"))
+	except ValueError as e:
+		return jsonify({"error": str(e)}), 400
+
+	per_page = min(max(request.args.get("per_page", ARCHIVE_PAGE_SIZE, type=int), 1), 500)
+	pagination = get_media_records(request.args.get("page", 1, type=int), per_page, request.args.get("type"),
+								   start, end, min_motion, min_noise)
+	return jsonify({
+		"page": pagination.page,
+		"pages": pagination.pages,
+		"total": pagination.total,
+		"records": [record_.to_dict() for record_ in pagination.items],
+	})
+
+ARCHIVE_MAX_AGE = 86400  # Seconds, an archive file never changes under its name
+
 @app.route('/archive/play/<string:filename>')
 def archive_play(filename):
-	# return send_file('archive/' + filename)
-	return send_file('media/' + filename)
+	# Byte ranges (206) for seeking, ETag / Last-Modified revalidation (304) for replays, the file itself
+	# goes through the server's file wrapper (sendfile) when it has one
+	return send_from_directory(MEDIA_DIR, filename, conditional=True, etag=True, max_age=ARCHIVE_MAX_AGE)
 
 @app.route("/chart")
 def chart_view():
 	return render_template("chart.html", legend="Weather Measures")
 
 # Read-Time chart
+CHART_POLL_INTERVAL = 2  # Seconds
+CHART_BACKFILL = 3600  # Seconds of history sent to a new chart, unless ?backfill= says otherwise
+
+def get_chart_data(wm):
+	return {
+		"timestamp": wm.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+		"temperature": wm.temperature,
+		"humidity": wm.humidity,
+	}
+
 @app.route('/chart-data-wm')
 def chart_data():
+	"""
+	Server-sent events of the WeatherMeasures rows: the last `backfill` seconds, then new rows as they are
+	added. Every event carries the row id, so a reconnecting EventSource resumes after the last row it got.
+	"""
+	last_event_id = request.headers.get("Last-Event-ID", "")
+	backfill = request.args.get("backfill", CHART_BACKFILL, type=int)
 
 	def generate_data():
 
-		lst_ids = []
+		with app.app_context():
+			if last_event_id.isdigit():
+				last_id = int(last_event_id)
+			else:
+				last_id = get_cursor_before(WeatherMeasures, datetime.datetime.now() - datetime.timedelta(seconds=backfill))
+
 		while True:
 
 			with app.app_context():
-				# lst_new_data = db.session.query(WeatherMeasures).filter(~WeatherMeasures.id.in_(lst_ids)).all()
-				dict_items = {}
+				lst_rows = [(wm_.id, get_chart_data(wm_)) for wm_ in get_rows_after(WeatherMeasures, last_id)]
 
-				for item_ in WeatherMeasures.query.all():
-					dict_items[item_.id] = item_
+			for id_, dict_data in lst_rows:
+				json_data = json.dumps(dict_data)
+				yield f"id:{id_}\ndata:{json_data}\n\n"
+				last_id = id_
 
-				lst_diff = list(set(dict_items.keys()) - set(lst_ids))
+			if not lst_rows:
+				time.sleep(CHART_POLL_INTERVAL)
 
-				for id_ in lst_diff:
-					wm_ = dict_items[id_]
-					dict_data = {}
-					dict_data["timestamp"] = wm_.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-					dict_data["temperature"] = wm_.temperature
-					dict_data["humidity"] = wm_.humidity
 
-					json_data = json.dumps(dict_data)
-					yield f"data:{json_data}\n\n"
+	return Response(generate_data(), mimetype='text/event-stream')
 
-				lst_ids += dict_items.keys()
+# History chart
+CHART_POINTS = 500
+CHART_POINTS_MAX = 5000
 
-				time.sleep(2)
+def parse_timestamp(value, default):
+	return datetime.datetime.fromisoformat(value) if value else default
 
+@app.route('/chart-range/<string:series>')
+def chart_range(series):
+	"""
+	min, max and mean of a series (temperature, humidity, motion, noise) over ?start= to ?end= (ISO dates,
+	default: the last ?seconds=, one day) in at most ?points= buckets, read from the rollups
+	"""
+	if series not in DICT_SERIES:
+		return jsonify({"error": "Unknown series {0}".format(series)}), 404
 
-	return Response(generate_data(), mimetype='text/event-stream')
+	try:
+		end = parse_timestamp(request.args.get("end"), datetime.datetime.now())
+		start = parse_timestamp(request.args.get("start"), end - datetime.timedelta(seconds=request.args.get("seconds", 86400, type=int)))
+	except ValueError as e:
+		return jsonify({"error": str(e)}), 400
 
+	points = min(max(request.args.get("points", CHART_POINTS, type=int), 1), CHART_POINTS_MAX)
+	if end <= start:
+		return jsonify({"error": "end must be after start"}), 400
 
+	return jsonify(get_range(series, start, end, points))
+
+
+@app.route("/transcoder-stats")
+@login_required
+def transcoder_stats():
+	return jsonify(thread_manager.transcoder.get_stats())
+
+@app.route("/db-stats")
+@login_required
+def db_stats():
+	return jsonify(db_writer.get_stats())
+
+@app.route("/retention-stats")
+@login_required
+def retention_stats():
+	return jsonify(retention_manager.get_stats())
+
+@app.route("/motion-stats")
+@login_required
+def motion_stats():
+	return jsonify(thread_manager.motion_detector.get_stats())
 
 @app.route("/dht-data")
 def dht_data():
@@ -222,23 +324,23 @@ def connect():
 
 @socketio.on('disconnect')
 def disconnect():
+	thread_manager.noise_detector.audio_stream.remove_listener(request.sid)
 	print('Client disconnected')
 
-def get_type(filename):
-	name, extension = os.path.splitext(filename)
-	return 'video' if extension in ['.mp4', '.avi'] else 'audio'
+@socketio.on('listen')
+def listen(data):
+	audio_stream = thread_manager.noise_detector.audio_stream
+	if data and data.get('on'):
+		audio_stream.add_listener(request.sid)
+	else:
+		audio_stream.remove_listener(request.sid)
 
-def get_records():
-	records = []
-
-	for filename in sorted(os.listdir(MEDIA_DIR), reverse=True):
-		if not filename.startswith('.'):
-			type = get_type(filename)
-			size = byte_to_mb(os.path.getsize(MEDIA_DIR + "/" + filename))
-			record = {"filename": filename, 'size': size, 'type': type}
-			records.append(record)
+def get_type(filename):
+	return get_media_type(filename)
 
-	return records
+def get_records(page=1):
+	# From the catalog, the media dir is not listed on every render
+	return get_media_records(page, ARCHIVE_PAGE_SIZE)
 
 def get_record_symbol():
 	return "fas fa-circle" if thread_manager.do_record else "far fa-circle"
@@ -254,10 +356,10 @@ class SoundStreamThread(threading.Thread):
 		super(self.__class__, self).__init__()
 
 	def run(self):
+		audio_stream = thread_manager.noise_detector.audio_stream
 		while True:
-			sound = thread_manager.noise_detector.get_chunk()
-			socketio.emit('sound', {'chunk': sound})
-			time.sleep(0.05)
+			for sid, packet in audio_stream.get_packets():
+				socketio.emit('sound', packet, room=sid)
 
 class DhtStreamThread(threading.Thread):
 	def __init__(self):
@@ -277,17 +379,22 @@ class DhtChartStreamThread(threading.Thread):
 
 	def run(self):
 
-		lst_data = []
+		with app.app_context():
+			last_id = get_cursor_before(WeatherMeasures, datetime.datetime.now() - datetime.timedelta(seconds=CHART_BACKFILL))
+
 		while True:
 			with app.app_context():
-				lst_data = list(set(WeatherMeasures.query.all()) - set(lst_data))
+				lst_rows = get_rows_after(WeatherMeasures, last_id)
 
-				for wm_ in lst_data:
+				for wm_ in lst_rows:
 					dict_data = {}
 					dict_data["time"] = wm_.timestamp.strftime('%Y-%m-%d %H:%M:%S')
 					dict_data["value"] = wm_.temperature
 					socketio.emit('chart-data', dict_data)
-					time.sleep(0.05)
+					last_id = wm_.id
+
+			if not lst_rows:
+				time.sleep(CHART_POLL_INTERVAL)
 
 
 class ThreadManagerMain(ThreadManager):
@@ -298,6 +405,12 @@ class ThreadManagerMain(ThreadManager):
 		self.last_dht_values = (0.0, 0.0) # humidity, temperature
 		self.last_det_values = (0.0, 0.0) # motion, noise
 
+	def on_record_done(self, output_file="", ended=0.0):
+		if os.path.dirname(os.path.abspath(output_file)) != MEDIA_DIR:
+			return
+		with app.app_context():
+			add_media_record(os.path.basename(output_file), os.path.getsize(output_file), datetime.datetime.fromtimestamp(ended))
+
 	def is_equal_values(self, values1=(), values2=()):
 
 		for i in range(len(values1)):
@@ -306,41 +419,29 @@ class ThreadManagerMain(ThreadManager):
 		return True
 
 	def write_in_base(self):
+		# Only queued here, db_writer commits in its own thread so a slow storage never delays merge_data
 		dict_dht_data = thread_manager.dht_detector.get_data()
 		current_dht_values = (dict_dht_data["hum"], dict_dht_data["temp"])
 
-		with app.app_context():
-			wm = None
-			det = None
-			if not self.is_equal_values(current_dht_values, self.last_dht_values):
-				wm = WeatherMeasures(humidity=current_dht_values[0],
-									 temperature=current_dht_values[1])
-				db.session.add(wm)
-
-			if thread_manager.record_state:
-				current_det_values = (thread_manager.motion_detector.value, thread_manager.noise_detector.value)
-				if sum(current_det_values) > 0.0 and not self.is_equal_values(current_det_values, self.last_det_values):
-					det = Detections(motion=current_det_values[0],
-									 noise=current_det_values[1])
-					db.session.add(det)
-
-					self.last_det_values = current_det_values
-
-			if wm or det:
-				db.session.commit()
-				if wm:
-					print(f"Insert {wm}")
-				if det:
-					print(f"Insert {det}")
-			pass
+		if not self.is_equal_values(current_dht_values, self.last_dht_values):
+			db_writer.add(WeatherMeasures(humidity=current_dht_values[0],
+										  temperature=current_dht_values[1],
+										  timestamp=datetime.datetime.now()))
+
+		if thread_manager.record_state:
+			current_det_values = (thread_manager.motion_detector.value, thread_manager.noise_detector.value)
+			if sum(current_det_values) > 0.0 and not self.is_equal_values(current_det_values, self.last_det_values):
+				db_writer.add(Detections(motion=current_det_values[0],
+										 noise=current_det_values[1],
+										 timestamp=datetime.datetime.now()))
+
+				self.last_det_values = current_det_values
 
 		self.last_dht_values = current_dht_values
 
 	def run(self):
 
-		self.motion_detector.start()
-		self.noise_detector.start()
-		self.dht_detector.start()
+		self.start_workers()
 		self.is_merged = False
 
 		while True:
@@ -350,25 +451,66 @@ class ThreadManagerMain(ThreadManager):
 
 app.jinja_env.globals.update(get_records=get_records)
 app.jinja_env.globals.update(get_record_symbol=get_record_symbol)
+app.jinja_env.globals.update(byte_to_mb=byte_to_mb)
+
+thread_manager = None  # Created by start_monitor()
+
+def prune_database():
+	with app.app_context():
+		return prune_rows(float(os.environ.get("ROWS_RETENTION_DAYS", "7")))
+
+def remove_deleted_record(filename):
+	with app.app_context():
+		remove_media_record(filename)
+
+def reconcile_catalog(index):
+	# Files the listeners do not see: deleted by hand, converted in a detector process
+	with app.app_context():
+		reconcile_media_records(index.dict_files)
+
+retention_manager = RetentionManager(MEDIA_DIR,
+									 max_age=float(os.environ.get("RETENTION_DAYS", "30")),
+									 max_size=int(os.environ.get("MEDIA_MAX_MB", "0")) * 2 ** 20,
+									 min_free=int(os.environ.get("MIN_FREE_MB", "500")) * 2 ** 20,
+									 prune_database=prune_database,
+									 on_delete=remove_deleted_record,
+									 on_change=reconcile_catalog)
+
+def start_monitor():
+	# Not at import: detector processes (DETECTOR_MODE=processes) import this module again while they start
+	global thread_manager
+
+	with app.app_context():
+		init_db()
+
+		# Archive files added or removed while the server was down
+		media_index = MediaIndex(MEDIA_DIR)
+		media_index.refresh()
+		reconcile_media_records(media_index.dict_files)
+
+	db_writer.start()
+
+	thread_manager = ThreadManagerMain()
+	thread_manager.media_dir = MEDIA_DIR
 
-thread_manager = ThreadManagerMain()
-thread_manager.media_dir = MEDIA_DIR
+	time.sleep(1)
+	thread_manager.start()
 
-time.sleep(1)
-thread_manager.start()
+	retention_manager.start()
 
-sound_stream_t = SoundStreamThread()
-sound_stream_t.start()
+	sound_stream_t = SoundStreamThread()
+	sound_stream_t.start()
 
-# dht_stream_t = DhtStreamThread()
-# dht_stream_t.start()
+	# dht_stream_t = DhtStreamThread()
+	# dht_stream_t.start()
 
-# dht_chart_stream_t = DhtChartStreamThread()
-# dht_chart_stream_t.start()
+	# dht_chart_stream_t = DhtChartStreamThread()
+	# dht_chart_stream_t.start()
 
-# detector_t = DetectorsThread()
-# detector_t.start()
+	# detector_t = DetectorsThread()
+	# detector_t.start()
 
 if __name__ == '__main__':
 	os.environ["PA_ALSA_PLUGHW"] = "1"
+	start_monitor()
 	socketio.run(app, log_output=False, host='0.0.0.0', port=7894, debug=True, use_reloader=False)
@@ -1,7 +1,9 @@
 
 
 let config = {
-	bufferSize: 2048
+	bufferSize: 2048,
+	preBuffer: 0.15,	// seconds buffered before playback starts
+	maxLatency: 1.0		// seconds, older samples are dropped
 }
 let player = new Player(config, socket);
 
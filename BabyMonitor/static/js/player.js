@@ -6,6 +6,9 @@ class Player {
 		this.audioCtx = null;
 		this.silence = new Float32Array(this.config.bufferSize);
 		this.playing = false;
+		this.lastSeq = 0;
+		this.lost = 0;
+		this.started = false;
 
 		this.audioQueue = {
 			buffer: new Float32Array(0),
@@ -24,6 +27,10 @@ class Player {
 				return samplesToPlay;
 			},
 
+			drop: function(nSamples) {
+				this.buffer = this.buffer.subarray(nSamples, this.buffer.length);
+			},
+
 			length: function() {
 				return this.buffer.length;
 			},
@@ -33,56 +40,112 @@ class Player {
 			}
 		}
 
+		// The server forgets the listener on disconnect: register again after a reconnect
+		socket.on('connect', function() {
+			self.lastSeq = 0;
+			if (self.isPlaying()) {
+				self.socket.emit('listen', {on: true});
+			}
+		});
+
 		socket.on('sound', function(data) {
-			if (self.scriptNode) {
-				//console.log("received");
-				let array = new Float32Array(data.chunk);
-				console.log(array);
-				self.audioQueue.write(array);
-
-				/*console.log(data.chunk);
-				var testDataInt = new Uint8Array(data.chunk);
-				console.log(testDataInt);
-				let array = self.int16ToFloat32(testDataInt, 0, data.chunk.length);
-				console.log(array);
-				self.audioQueue.write(array);*/
+			if (!self.scriptNode) {
+				return;
+			}
+
+			// Packets are numbered once per captured chunk, skip duplicates and count the gaps
+			if (data.seq === self.lastSeq) {
+				return;
+			}
+			if (data.seq < self.lastSeq) {
+				self.lastSeq = 0;  // Numbering restarted with the server
+			}
+			if (self.lastSeq && data.seq > self.lastSeq + 1) {
+				self.lost += data.seq - self.lastSeq - 1;
+			}
+			self.lastSeq = data.seq;
+
+			let samples = data.encoding === 'mulaw' ? self.mulawToFloat32(new Uint8Array(data.chunk)) : self.int16ToFloat32(new Int16Array(data.chunk));
+			self.audioQueue.write(self.resample(samples, data.rate, self.audioCtx.sampleRate));
+
+			// Keep the latency bounded on a jittery connection
+			let maxSamples = self.audioCtx.sampleRate * self.config.maxLatency;
+			if (self.audioQueue.length() > maxSamples) {
+				self.audioQueue.drop(self.audioQueue.length() - maxSamples);
 			}
 		});
 	}
 
 	play() {
 		this.playing = true;
+		this.started = false;
+		this.lastSeq = 0;
 		this.audioCtx = new AudioContext();
 		this.scriptNode = this.audioCtx.createScriptProcessor(this.config.bufferSize, 1, 1);
 		this.scriptNode.onaudioprocess = (e) => {
-			if (this.audioQueue.length()) {
+			// Wait for a little pre-buffer before starting, and again after running dry
+			let minSamples = this.audioCtx.sampleRate * this.config.preBuffer;
+			if (!this.started && this.audioQueue.length() >= minSamples) {
+				this.started = true;
+			}
+
+			if (this.started && this.audioQueue.length() >= this.config.bufferSize) {
 				e.outputBuffer.getChannelData(0).set(this.audioQueue.read(this.config.bufferSize));
 			}
 			else {
+				this.started = false;
 				e.outputBuffer.getChannelData(0).set(this.silence);
 			}
 		}
 
 		this.scriptNode.connect(this.audioCtx.destination);
+		this.socket.emit('listen', {on: true});
 	}
 
 	stop() {
+		this.socket.emit('listen', {on: false});
 		this.audioQueue.clear();
 		this.scriptNode.disconnect();
 		this.scriptNode = null;
+		this.audioCtx.close();
 	}
 
 	isPlaying() {
 		return !! this.scriptNode;
 	}
 
-	int16ToFloat32(inputArray, startIndex, length) {
-		var output = new Float32Array(inputArray.length-startIndex);
-		for (var i = startIndex; i < length; i++) {
-			var int = inputArray[i];
-			// If the high bit is on, then it is a negative number, and actually counts backwards.
-			var float = (int >= 0x8000) ? -(0x10000 - int) / 0x8000 : int / 0x7FFF;
-			output[i] = float;
+	resample(inputArray, inputRate, outputRate) {
+		if (inputRate === outputRate) {
+			return inputArray;
+		}
+
+		// Linear interpolation
+		let ratio = inputRate / outputRate;
+		let output = new Float32Array(Math.floor(inputArray.length / ratio));
+		for (let i = 0; i < output.length; i++) {
+			let position = i * ratio;
+			let index = Math.floor(position);
+			let next = Math.min(index + 1, inputArray.length - 1);
+			let fraction = position - index;
+			output[i] = inputArray[index] * (1 - fraction) + inputArray[next] * fraction;
+		}
+		return output;
+	}
+
+	mulawToFloat32(inputArray) {
+		let output = new Float32Array(inputArray.length);
+		let mu = 255;
+		for (let i = 0; i < inputArray.length; i++) {
+			let companded = inputArray[i] / 127.5 - 1;
+			output[i] = Math.sign(companded) * (Math.pow(1 + mu, Math.abs(companded)) - 1) / mu;
+		}
+		return output;
+	}
+
+	int16ToFloat32(inputArray) {
+		let output = new Float32Array(inputArray.length);
+		for (let i = 0; i < inputArray.length; i++) {
+			output[i] = inputArray[i] / 0x7FFF;
 		}
 		return output;
 	}
@@ -0,0 +1,57 @@
+"""
+Cost per frame of handing 640x480 frames to consumers: a fresh array per frame that every consumer copies
+(the former MotionDetector.current_frame path) against lib/frame_bus.FrameBus slots read in place
+
+    python -m benchmarks.bench_frame_bus [frames] [consumers]
+"""
+import sys
+import time
+import numpy as np
+
+from BabyMonitor.lib import frame_bus
+
+SHAPE = (480, 640, 3)
+
+
+def bench_copies(source, count, consumers):
+    start = time.perf_counter()
+    for i in range(count):
+        frame = source.copy()  # VideoCapture.read() allocates every frame
+        for consumer_ in range(consumers):
+            frame.copy()
+    return (time.perf_counter() - start) * 1000 / count
+
+
+def bench_bus(source, count, consumers):
+    bus = frame_bus.FrameBus(shape=SHAPE)
+    reader = frame_bus.FrameBus(bus.name)
+
+    start = time.perf_counter()
+    invalid = 0
+    for i in range(count):
+        np.copyto(bus.acquire(SHAPE), source)  # Stands in for VideoCapture.read(slot)
+        bus.commit(time.time())
+        for consumer_ in range(consumers):
+            frame_ref = reader.get_latest()
+            invalid += not frame_ref.is_valid()
+    elapsed = (time.perf_counter() - start) * 1000 / count
+
+    reader.close()
+    bus.close()
+    return elapsed, invalid
+
+
+def main(count=2000, consumers=3):
+    source = np.random.default_rng(0).integers(0, 255, SHAPE, dtype=np.uint8)
+    print("{0} frames of {1}x{2}, {3} consumers".format(count, SHAPE[1], SHAPE[0], consumers))
+
+    copies = bench_copies(source, count, consumers)
+    print("{0:<26} {1:6.3f} ms/frame".format("new array + copies", copies))
+
+    bus, invalid = bench_bus(source, count, consumers)
+    print("{0:<26} {1:6.3f} ms/frame ({2} invalid reads)".format("frame bus, zero-copy", bus, invalid))
+    print("{0:<26} {1:.1f}x".format("speedup", copies / bus))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000, int(sys.argv[2]) if len(sys.argv) > 2 else 3)
@@ -0,0 +1,75 @@
+"""
+Constant frame rate resampling of jittery capture timestamps: the previous O(frames^2) min() search
+of MotionDetector.save against lib/frame_resampler (vectorized and streaming)
+
+    python -m benchmarks.bench_frame_resampler [minutes]
+"""
+import sys
+import time
+import numpy as np
+
+from BabyMonitor.lib import frame_resampler
+
+FRAME_RATE = 15
+
+
+def get_timestamps(seconds=60, capture_rate=12.0, jitter=0.25, stall_every=200, seed=0):
+    # Camera slower than the output rate, with jitter and an occasional stall (e.g. while the SD card syncs)
+    rng = np.random.default_rng(seed)
+    count = int(seconds * capture_rate)
+    intervals = rng.normal(1.0 / capture_rate, jitter / capture_rate, count).clip(0.2 / capture_rate)
+    intervals[::stall_every] += 0.4
+    return 1600000000.0 + np.cumsum(intervals)
+
+
+def legacy_indices(timestamps):
+    # Former MotionDetector.save search, returning frame indexes instead of writing frames
+    data = list(enumerate(timestamps))
+    zero_timestamp = timestamps[0]
+    time_step = 1 / FRAME_RATE
+    lst_indices = []
+    timestamp_value = 0
+    while timestamp_value <= timestamps[-1] - zero_timestamp:
+        index_, closest_timestamp_ = min(data, key=lambda x: abs((x[1] - zero_timestamp) - timestamp_value))
+        lst_indices.append(index_)
+        timestamp_value += time_step
+    return np.array(lst_indices)
+
+
+def streaming_indices(timestamps):
+    resampler = frame_resampler.FrameResampler(FRAME_RATE)
+    lst_indices = []
+    for index_, timestamp_ in enumerate(timestamps):
+        lst_indices.extend(resampler.push(timestamp_, index_))
+    lst_indices.extend(resampler.flush())
+    return np.array(lst_indices), resampler.get_stats()
+
+
+def timeit(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main(minutes=(0.5, 1, 5, 30), legacy_limit=5):
+    for minutes_ in minutes:
+        timestamps = get_timestamps(minutes_ * 60)
+        print("\n{0} min, {1} frames captured".format(minutes_, len(timestamps)))
+
+        vector_time, vector = timeit(frame_resampler.resample_indices, timestamps, FRAME_RATE)
+        stream_time, (stream, dict_stats) = timeit(streaming_indices, timestamps)
+
+        assert np.array_equal(vector, stream), "vectorized and streaming resampling disagree"
+        assert dict_stats == frame_resampler.get_resample_stats(vector, len(timestamps))
+
+        print("    vectorized {0:9.4f} s | streaming {1:9.4f} s | {2}".format(vector_time, stream_time, dict_stats))
+
+        if minutes_ <= legacy_limit:
+            legacy_time, legacy = timeit(legacy_indices, timestamps)
+            mismatches = np.count_nonzero(legacy[:len(vector)] != vector[:len(legacy)]) + abs(len(legacy) - len(vector))
+            print("    legacy     {0:9.4f} s ({1:.0f}x slower than vectorized), {2} slots differ".format(
+                legacy_time, legacy_time / vector_time, mismatches))
+
+
+if __name__ == '__main__':
+    main([float(arg) for arg in sys.argv[1:]] if len(sys.argv) > 1 else (0.5, 1, 5, 30))
@@ -0,0 +1,116 @@
+"""
+Per stage timing of the motion analysis: the previous full resolution pipeline against
+lib/motion_analysis.MotionAnalyzer at several scales, on the same synthetic frames
+
+    python -m benchmarks.bench_motion_analysis [frames]
+"""
+import sys
+import time
+import cv2
+import numpy as np
+
+from BabyMonitor.lib import motion_analysis
+from BabyMonitor.lib import motion_zones
+
+WIDTH, HEIGHT = 640, 480
+
+
+def get_frames(count=150):
+    # Noisy static scene with a slowly moving block, like a baby in a cot
+    rng = np.random.default_rng(0)
+    background = rng.integers(40, 200, (HEIGHT, WIDTH, 3), dtype=np.uint8)
+    background = cv2.GaussianBlur(background, (31, 31), 0)
+
+    lst_frames = []
+    for i in range(count):
+        frame = background.copy()
+        cv2.add(frame, rng.integers(0, 6, frame.shape, dtype=np.uint8), dst=frame)
+        x = 100 + (i * 3) % (WIDTH - 250)
+        cv2.rectangle(frame, (x, 180), (x + 120, 300), (230, 220, 210), -1)
+        lst_frames.append(frame)
+    return lst_frames
+
+
+def legacy_process(frames):
+    # Former MotionDetector.run analysis, kept here as the baseline
+    dict_times = dict.fromkeys(motion_analysis.STAGES, 0.0)
+    lst_values = []
+    previous_frame = None
+
+    for frame in frames:
+        t0 = time.perf_counter()
+        frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        t1 = time.perf_counter()
+        frame_blur = cv2.GaussianBlur(frame_gray, (21, 21), 0)
+        t2 = time.perf_counter()
+        dict_times["gray"] += t1 - t0
+        dict_times["blur"] += t2 - t1
+
+        if previous_frame is None:
+            previous_frame = frame_blur
+            continue
+
+        delta_frame = cv2.absdiff(previous_frame, frame_blur)
+        t3 = time.perf_counter()
+        threshold_frame = cv2.threshold(delta_frame, 15, 255, cv2.THRESH_BINARY)[1]
+        t4 = time.perf_counter()
+        kernel = np.ones((5, 5), np.uint8)
+        dilated_frame = cv2.dilate(threshold_frame, kernel, iterations=4)
+        t5 = time.perf_counter()
+        res = dilated_frame.astype(np.uint8)
+        lst_values.append((np.count_nonzero(res) * 100) / res.size)
+        t6 = time.perf_counter()
+
+        dict_times["delta"] += t3 - t2
+        dict_times["threshold"] += t4 - t3
+        dict_times["dilate"] += t5 - t4
+        dict_times["count"] += t6 - t5
+        previous_frame = frame_blur
+
+    count = max(1, len(lst_values))
+    return {stage: total * 1000 / count for stage, total in dict_times.items()}, lst_values
+
+
+def analyzer_process(frames, analyzer):
+    analyzer.profile = True
+    lst_values = []
+    for frame in frames:
+        value = analyzer.process(frame)
+        if value is not None:
+            lst_values.append(value)
+    return analyzer.get_stage_times(), lst_values
+
+
+def report(name, dict_times, lst_values, reference=None):
+    total = sum(dict_times.values())
+    stages = " ".join("{0} {1:5.2f}".format(stage, dict_times[stage]) for stage in motion_analysis.STAGES)
+    line = "{0:<22} {1:6.2f} ms/frame ({2:6.1f} fps) | {3} | mean motion {4:5.2f}%".format(
+        name, total, 1000 / total if total else 0.0, stages, np.mean(lst_values))
+    if reference is not None:
+        line += " | corr {0:.3f}".format(np.corrcoef(reference, lst_values)[0, 1])
+    print(line)
+    return total
+
+
+def main(count=150):
+    frames = get_frames(count)
+    print("{0} frames of {1}x{2}, ms per frame per stage".format(count, WIDTH, HEIGHT))
+
+    dict_times, reference = legacy_process(frames)
+    legacy_total = report("legacy full res", dict_times, reference)
+
+    for scale in (1.0, 0.5, 0.25):
+        dict_times, lst_values = analyzer_process(frames, motion_analysis.MotionAnalyzer(scale=scale))
+        total = report("analyzer x{0}".format(scale), dict_times, lst_values, reference)
+        print("{0:<22} speedup {1:.1f}x".format("", legacy_total / total))
+
+    dict_times, lst_values = analyzer_process(frames, motion_analysis.MotionAnalyzer(scale=0.5, roi=(80, 120, 480, 300)))
+    report("analyzer x0.5 + roi", dict_times, lst_values)
+
+    zone = motion_zones.MotionZone("crib", [(100, 160), (420, 160), (460, 320), (60, 320)])
+    dict_times, lst_values = analyzer_process(frames, motion_analysis.MotionAnalyzer(scale=0.5, zones=[zone]))
+    report("analyzer x0.5 + zone", dict_times, lst_values)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 150)
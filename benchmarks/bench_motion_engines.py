@@ -0,0 +1,90 @@
+"""
+Replay the same frames through every motion engine (lib/motion_analysis.DICT_ENGINES) and report the cost
+per frame and what each one detects: frames over the MotionDetector threshold and trigger activations
+
+    python -m benchmarks.bench_motion_engines [video file] [frames]
+
+Without a video file the synthetic scene of bench_motion_analysis is used, with a slow moving block and
+an auto-exposure jump added.
+"""
+import sys
+import time
+import cv2
+import numpy as np
+
+from BabyMonitor.lib import motion_analysis
+from BabyMonitor.lib import trigger
+from BabyMonitor.lib import utils
+from benchmarks import bench_motion_analysis
+
+THRESHOLD = 7  # MotionDetector.threshold
+FRAME_RATE = 15
+
+
+def read_frames(file_path="", count=300):
+    video = cv2.VideoCapture(file_path)
+    lst_frames = []
+    while len(lst_frames) < count:
+        grabbed, frame = video.read()
+        if not grabbed:
+            break
+        lst_frames.append(frame)
+    video.release()
+    return lst_frames
+
+
+def get_frames(count=300):
+    lst_frames = bench_motion_analysis.get_frames(count)
+
+    # A block creeping 1 px per frame, and the camera brightening for a moment half way through
+    for i, frame in enumerate(lst_frames):
+        cv2.rectangle(frame, (40 + i // 2, 360), (120 + i // 2, 440), (90, 90, 90), -1)
+        if count // 2 <= i < count // 2 + 3:
+            cv2.convertScaleAbs(frame, dst=frame, alpha=1.2)
+    return lst_frames
+
+
+def replay(frames, analyzer):
+    trigger_ = trigger.SlidingWindowTrigger(utils.OBSERVER_LENGTH * FRAME_RATE)
+    lst_values = []
+    activations = 0
+
+    start = time.perf_counter()
+    for frame in frames:
+        value = analyzer.process(frame)
+        if value is None:
+            continue
+        lst_values.append(value)
+
+        was_active = trigger_.active
+        trigger_.update(value > THRESHOLD)
+        activations += trigger_.active and not was_active
+    elapsed = time.perf_counter() - start
+
+    values = np.array(lst_values)
+    return {
+        "ms_per_frame": elapsed * 1000 / max(1, len(frames)),
+        "mean": float(values.mean()) if len(values) else 0.0,
+        "max": float(values.max()) if len(values) else 0.0,
+        "detections": int(np.count_nonzero(values > THRESHOLD)),
+        "activations": activations,
+    }
+
+
+def main(file_path="", count=300):
+    frames = read_frames(file_path, count) if file_path else get_frames(count)
+    if not frames:
+        print("No frames read from {0}".format(file_path))
+        return
+
+    height, width = frames[0].shape[:2]
+    print("{0} frames of {1}x{2} from {3}, threshold {4}%".format(len(frames), width, height, file_path or "synthetic scene", THRESHOLD))
+
+    for name in motion_analysis.DICT_ENGINES:
+        dict_result = replay(frames, motion_analysis.get_engine(name))
+        print("{0:<16} {ms_per_frame:6.2f} ms/frame | motion mean {mean:5.2f}% max {max:6.2f}% | "
+              "frames over threshold {detections:4d} | trigger activations {activations}".format(name, **dict_result))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else "", int(sys.argv[2]) if len(sys.argv) > 2 else 300)
@@ -0,0 +1,51 @@
+"""
+Per chunk cost of every noise engine against the 48 kHz real-time budget,
+plus the level and scores each engine gives to a synthetic cry, fan and hum
+
+    python -m benchmarks.bench_noise_engines [chunks]
+"""
+import sys
+import time
+import numpy as np
+
+from BabyMonitor.lib import noise_engines
+
+RATE = 48000
+CHUNK_SIZE = 2048
+
+
+def get_signals():
+    rng = np.random.default_rng(0)
+    t = np.arange(CHUNK_SIZE) / RATE
+
+    # Cry: ~450 Hz fundamental with harmonics, fan: white noise, hum: 60 Hz mains + low rumble
+    cry = sum(np.sin(2 * np.pi * 450 * k * t) / k for k in range(1, 6)) * 0.05
+    fan = rng.standard_normal(CHUNK_SIZE) * 0.05
+    hum = np.sin(2 * np.pi * 60 * t) * 0.1 + rng.standard_normal(CHUNK_SIZE) * 0.005
+
+    return {name: signal.astype(np.float32) for name, signal in (("cry", cry), ("fan", fan), ("hum", hum))}
+
+
+def main(chunks=2000):
+    signals = get_signals()
+    chunk_duration = CHUNK_SIZE / RATE
+    print("Budget per chunk: {0:.3f} ms ({1} samples at {2} Hz)".format(chunk_duration * 1000, CHUNK_SIZE, RATE))
+
+    for name in noise_engines.DICT_ENGINES:
+        engine = noise_engines.get_engine(name, RATE, CHUNK_SIZE)
+
+        samples = signals["fan"]
+        start = time.perf_counter()
+        for i in range(chunks):
+            engine.process(samples)
+        per_chunk = (time.perf_counter() - start) / chunks
+
+        print("\n{0:<10} {1:8.4f} ms per chunk, {2:6.1f}x real time".format(name, per_chunk * 1000, chunk_duration / per_chunk))
+        for signal_name, signal in signals.items():
+            level = engine.process(signal)
+            score = engine.band_scores.get("score", "-")
+            print("    {0:<4} level {1:.5f}  score {2}".format(signal_name, level, score))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,151 @@
+"""
+End to end throughput of the detectors on replayed input (lib/capture_sources), no camera or microphone needed
+
+- MotionDetector: grab and analysis frames per second, frames skipped by the analysis, ms per analysis stage
+- NoiseDetector: chunks per second and ms per stage of the read loop
+- ThreadManager.merge_data: ms per call while both detectors run and record
+
+Sources are read as fast as possible unless --realtime is given, in which case the numbers show whether the
+pipeline keeps up with the devices. Peak memory is the tracemalloc peak (Python and numpy allocations) of
+every section, and the process' maximum resident size at the end.
+
+    python -m benchmarks.bench_pipeline [--video file] [--wav file] [--seconds 60] [--realtime]
+"""
+import argparse
+import os
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from BabyMonitor.lib import capture_sources
+from BabyMonitor.lib import motion_analysis
+from BabyMonitor.lib import motion_detector
+from BabyMonitor.lib import noise_detector
+from BabyMonitor.lib import thread_manager
+
+FRAME_RATE = 15
+RATE = 48000
+
+
+def get_video_source(args):
+    if args.video:
+        return capture_sources.FileVideoSource(args.video, realtime=args.realtime)
+    # One extra frame, MotionDetector reads one to get the resolution
+    return capture_sources.SyntheticVideoSource(frame_rate=FRAME_RATE, count=int(args.seconds * FRAME_RATE) + 1,
+                                                realtime=args.realtime)
+
+
+def get_audio_source(args):
+    if args.wav:
+        return capture_sources.WavAudioSource(args.wav, RATE, realtime=args.realtime)
+    return capture_sources.SyntheticAudioSource(args.seconds, RATE, realtime=args.realtime)
+
+
+def format_stages(dict_times, lst_stages):
+    return " ".join("{0} {1:.3f}".format(stage, dict_times[stage]) for stage in lst_stages)
+
+
+def measure(target):
+    """
+    @return tuple: (seconds, tracemalloc peak in bytes) of running target()
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    target()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def bench_motion(args, media_dir):
+    detector = motion_detector.MotionDetector(get_video_source(args), do_record=False, do_convert=False,
+                                              analysis_rate=FRAME_RATE if args.realtime else 10000)
+    detector.media_dir = media_dir
+    detector.analyzer.profile = True
+
+    def run():
+        detector.start()
+        detector.join()
+
+    elapsed, peak = measure(run)
+    dict_stats = detector.get_stats()
+
+    print("MotionDetector:  grabbed {grabbed} frames, {0:.1f} fps | analysed {analysed}, {1:.1f} fps, skipped {analysis_dropped}".format(
+        dict_stats["grabbed"] / elapsed, dict_stats["analysed"] / elapsed, **dict_stats))
+    print("                 ms per frame: {0}".format(format_stages(detector.analyzer.get_stage_times(), motion_analysis.STAGES)))
+    print("                 peak memory {0:.1f} MB".format(peak / 2 ** 20))
+
+
+def bench_noise(args, media_dir):
+    detector = noise_detector.NoiseDetector(do_record=True, do_convert=False, audio_source=get_audio_source(args))
+    detector.media_dir = media_dir
+    detector.profile = True
+
+    def run():
+        detector.start()
+        detector.join()
+
+    elapsed, peak = measure(run)
+
+    print("NoiseDetector:   {0} chunks, {1:.1f} chunks/s ({2:.1f}x realtime)".format(
+        detector.chunk_count, detector.chunk_count / elapsed, detector.chunk_count * detector.CHUNK_SIZE / RATE / elapsed))
+    print("                 ms per chunk: {0}".format(format_stages(detector.get_stage_times(), noise_detector.NOISE_STAGES)))
+    print("                 peak memory {0:.1f} MB".format(peak / 2 ** 20))
+
+
+def bench_merge_data(args, media_dir):
+    manager = thread_manager.ThreadManager(video_source=get_video_source(args), audio_source=get_audio_source(args))
+    manager.media_dir = media_dir
+    manager.motion_detector.media_dir = media_dir
+    manager.noise_detector.media_dir = media_dir
+    manager.motion_detector.analysis_rate = FRAME_RATE if args.realtime else 10000
+    manager.do_record = True
+    manager.fill_do_record()
+
+    lst_times = []
+
+    def run():
+        manager.motion_detector.start()
+        manager.noise_detector.start()
+
+        while manager.motion_detector.is_alive() or manager.noise_detector.is_alive():
+            start = time.perf_counter()
+            manager.merge_data()
+            lst_times.append(time.perf_counter() - start)
+            time.sleep(0.01)
+
+    elapsed, peak = measure(run)
+    lst_times.sort()
+
+    print("merge_data:      {0} calls in {1:.1f} s | mean {2:.3f} ms, p99 {3:.3f} ms, max {4:.3f} ms".format(
+        len(lst_times), elapsed, sum(lst_times) * 1000 / len(lst_times), lst_times[int(len(lst_times) * 0.99)] * 1000,
+        lst_times[-1] * 1000))
+    print("                 peak memory {0:.1f} MB, {1} files recorded".format(peak / 2 ** 20, len(os.listdir(media_dir))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--video", default="", help="video file instead of the synthetic scene")
+    parser.add_argument("--wav", default="", help="WAV file instead of the synthetic tones")
+    parser.add_argument("--seconds", type=float, default=60.0, help="length of the synthetic input")
+    parser.add_argument("--realtime", action="store_true", help="deliver the input at the device rates")
+    args = parser.parse_args()
+
+    print("{0} input, {1}".format("file" if args.video or args.wav else "{0:.0f} s of synthetic".format(args.seconds),
+                                  "realtime" if args.realtime else "as fast as possible"))
+
+    media_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    try:
+        for bench_ in (bench_motion, bench_noise, bench_merge_data):
+            bench_(args, media_dir)
+    finally:
+        shutil.rmtree(media_dir, ignore_errors=True)
+
+    print("max resident size {0:.1f} MB".format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Audio history as a deque of bytes (previous NoiseDetector.deque_history) against lib/ring_buffer:
+throughput of storing a chunk and handing it to an engine, cost of taking the pre-roll, and allocations
+
+    python -m benchmarks.bench_ring_buffer [chunks]
+"""
+import sys
+import time
+import tracemalloc
+from collections import deque
+import numpy as np
+
+from BabyMonitor.lib import ring_buffer
+
+RATE = 48000
+CHUNK_SIZE = 2048
+HISTORY_LENGTH = 2  # Seconds
+CHUNKS_PER_SEC = RATE // CHUNK_SIZE
+
+
+class DequeHistory:
+
+    def __init__(self):
+        self.deque_history = deque(maxlen=HISTORY_LENGTH * CHUNKS_PER_SEC)
+
+    def write(self, chunk):
+        self.deque_history.append(chunk)
+        return np.frombuffer(chunk, np.float32)
+
+    def get_latest(self):
+        return np.frombuffer(b''.join(self.deque_history), np.float32)
+
+
+class RingHistory:
+
+    def __init__(self):
+        self.ring = ring_buffer.AudioRingBuffer(HISTORY_LENGTH * RATE)
+
+    def write(self, chunk):
+        return self.ring.write(chunk)
+
+    def get_latest(self):
+        return self.ring.get_latest()
+
+
+def run(history, chunks, count):
+    checksum = 0.0
+
+    start = time.perf_counter()
+    for i in range(count):
+        samples = history.write(chunks[i % len(chunks)])
+        checksum += float(samples[0])
+    write_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(count // CHUNKS_PER_SEC):
+        checksum += float(history.get_latest()[0])
+    latest_time = time.perf_counter() - start
+
+    return write_time, latest_time, checksum
+
+
+def measure(history_class, chunks, count):
+    history = history_class()
+    run(history, chunks, len(chunks))  # Warm up, fill the history
+
+    write_time, latest_time, checksum = run(history, chunks, count)
+
+    # Peak of memory allocated while running, the history itself was allocated before
+    tracemalloc.start()
+    run(history, chunks, count // 10)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return write_time, latest_time, peak
+
+
+def main(count=20000):
+    rng = np.random.default_rng(0)
+    # Stream.read() returns a new bytes object per chunk, cycle a pool of them
+    chunks = [rng.standard_normal(CHUNK_SIZE).astype(np.float32).tobytes() for _ in range(HISTORY_LENGTH * CHUNKS_PER_SEC * 2)]
+
+    print("{0} chunks of {1} samples, {2} s history".format(count, CHUNK_SIZE, HISTORY_LENGTH))
+    for name, history_class in (("deque of bytes", DequeHistory), ("ring buffer", RingHistory)):
+        write_time, latest_time, peak = measure(history_class, chunks, count)
+        print("{0:<15} write {1:7.2f} us/chunk ({2:7.0f}x real time) | pre-roll {3:8.2f} us | allocated peak {4:8.1f} KB".format(
+            name, write_time / count * 1e6, (CHUNK_SIZE / RATE) / (write_time / count),
+            latest_time / max(1, count // CHUNKS_PER_SEC) * 1e6, peak / 1024))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,93 @@
+"""
+Compare the per-sample struct.pack WAVE generation against wav_writer
+
+    python -m benchmarks.bench_wav_writer [seconds]
+"""
+import os
+import sys
+import struct
+import tempfile
+import time
+import numpy as np
+
+from BabyMonitor.lib import wav_writer
+
+RATE = 48000
+CHANNELS = 1
+CHUNK_SIZE = 2048
+
+
+def legacy_generate_wav(raw):
+    # Former NoiseDetector.generate_wav, kept here as the baseline
+    samples = np.frombuffer(raw, np.float32)
+    sample_size = 4
+    byte_count = len(samples) * sample_size
+    bits_per_sample = sample_size * 8
+    frame_size = int(CHANNELS * ((bits_per_sample + 7) / 8))
+
+    wav = bytearray()
+    wav.extend(struct.pack('<cccc', b'R', b'I', b'F', b'F'))
+    wav.extend(struct.pack('<I', byte_count + 0x2c - 8))
+    wav.extend(struct.pack('<cccc', b'W', b'A', b'V', b'E'))
+    wav.extend(struct.pack('<cccc', b'f', b'm', b't', b' '))
+    wav.extend(struct.pack('<I', 0x10))
+    wav.extend(struct.pack('<H', 3))
+    wav.extend(struct.pack('<H', CHANNELS))
+    wav.extend(struct.pack('<I', RATE))
+    wav.extend(struct.pack('<I', RATE * frame_size))
+    wav.extend(struct.pack('<H', frame_size))
+    wav.extend(struct.pack('<H', bits_per_sample))
+    wav.extend(struct.pack('<cccc', b'd', b'a', b't', b'a'))
+    wav.extend(struct.pack('<I', byte_count))
+    for sample in samples:
+        wav.extend(struct.pack("<f", sample))
+
+    return bytes(wav)
+
+
+def get_chunks(seconds=60):
+    rng = np.random.default_rng(0)
+    total = int(seconds * RATE / CHUNK_SIZE)
+    return [rng.standard_normal(CHUNK_SIZE).astype(np.float32).tobytes() for _ in range(total)]
+
+
+def timeit(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main(seconds=60):
+    chunks = get_chunks(seconds)
+    print("{0} s of {1} Hz float32 audio in {2} chunks".format(seconds, RATE, len(chunks)))
+
+    legacy_time, legacy_wav = timeit(lambda: legacy_generate_wav(b''.join(chunks)))
+    print("legacy generate_wav:     {0:8.3f} s".format(legacy_time))
+
+    new_time, new_wav = timeit(lambda: wav_writer.generate_wav(b''.join(chunks), RATE, CHANNELS))
+    print("wav_writer.generate_wav: {0:8.3f} s ({1:.0f}x)".format(new_time, legacy_time / new_time))
+    assert new_wav == legacy_wav
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "bench.wav")
+
+        def stream():
+            writer = wav_writer.WavWriter(file_path, RATE, CHANNELS)
+            chunk_times = []
+            for chunk in chunks:
+                start = time.perf_counter()
+                writer.write(chunk)
+                chunk_times.append(time.perf_counter() - start)
+            writer.close()
+            return chunk_times
+
+        stream_time, chunk_times = timeit(stream)
+        print("WavWriter streaming:     {0:8.3f} s ({1:.0f}x), max {2:.3f} ms per chunk".format(
+            stream_time, legacy_time / stream_time, max(chunk_times) * 1000))
+
+        with open(file_path, "rb") as f:
+            assert f.read() == legacy_wav
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 60)